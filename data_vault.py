@@ -39,7 +39,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue
 import labrad.util
 import labrad.wrappers
 
-from datavault import SessionStore
+from datavault import DEFAULT_OPTIONS, SessionStore
 from datavault.server import DataVault
 
 
@@ -79,6 +79,29 @@ def load_settings(cxn, name):
         print('To change this, edit the registry keys and restart the server.')
     returnValue(datadir)
 
+@inlineCallbacks
+def load_options(cxn, name):
+    """Load optional server-wide settings from the registry.
+
+    Keys in the registry directory ['', 'Servers', name, 'Options'] override
+    the entries of datavault.DEFAULT_OPTIONS with the same name.  The
+    directory does not need to exist.
+    """
+    path = ['', 'Servers', name]
+    reg = cxn.registry
+    yield reg.cd(path, True)
+    (dirs, keys) = yield reg.dir()
+    options = {}
+    if 'Options' in dirs:
+        yield reg.cd('Options')
+        (dirs, keys) = yield reg.dir()
+        for key in keys:
+            if key in DEFAULT_OPTIONS:
+                options[key] = yield reg.get(key)
+            else:
+                print('Ignoring unknown option in registry: {}'.format(key))
+    returnValue(options)
+
 def main(argv=sys.argv):
     @inlineCallbacks
     def start():
@@ -86,8 +109,9 @@ def main(argv=sys.argv):
         cxn = yield labrad.wrappers.connectAsync(
             host=opts['host'], port=int(opts['port']), password=opts['password'])
         datadir = yield load_settings(cxn, opts['name'])
+        options = yield load_options(cxn, opts['name'])
         yield cxn.disconnect()
-        session_store = SessionStore(datadir, hub=None)
+        session_store = SessionStore(datadir, hub=None, options=options)
         server = DataVault(session_store)
         session_store.hub = server
 
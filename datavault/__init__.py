@@ -2,9 +2,13 @@
 from datetime import datetime
 import os
 import re
-#import collections
+import time
+import collections
 import weakref
 
+from twisted.internet import defer, reactor
+from twisted.python import failure, log
+import numpy as np
 #from labrad import types as T
 
 from . import backend, errors, util
@@ -82,11 +86,73 @@ def parse_dependent(s):
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
 
 
+## server-wide options, which can be overridden from the registry
+
+DEFAULT_OPTIONS = {
+    # layout of new HDF5 datasets; see backend.create_backend
+    'chunk_rows': 0, # rows per chunk, 0 lets h5py decide
+    'compression': '', # '', 'gzip', 'gzip:<level>' or 'lzf'
+    'shuffle': False, # byte-shuffle filter, helps compression of numbers
+
+    # write-behind buffering of added rows; see Dataset.addData
+    'flush_rows': 0, # write once this many rows are buffered, 0 disables buffering
+    'flush_bytes': 1 << 20, # write once the buffered rows take this many bytes
+    'flush_delay': 0.1, # seconds a buffered row may wait before it is written
+    'write_retries': 3, # failed writes of buffered rows retried before they are dropped
+
+    # worker threads for reading, writing and opening HDF5 files, so that
+    # large reads do not block the server.  0 does all I/O on the reactor.
+    'io_threads': 0,
+
+    # most data files kept open at once; the least recently used file is
+    # closed to make room for another.  0 puts no limit on open files.
+    'max_open_files': backend.MAX_OPEN_FILES,
+
+    # sessions and datasets are kept in memory while clients use them; these
+    # keep the most recently used ones a while longer, so that clients moving
+    # between directories do not reload them each time.  0 disables a cache.
+    # Cached sessions are listed by 'dump existing sessions', so the session
+    # cache is off unless configured.
+    'session_cache_size': 0,
+    'dataset_cache_size': 64,
+    'cache_max_age': 600, # seconds an unused object stays cached, 0 for no limit
+
+    # seconds to wait before saving access times and tags to session.ini, so
+    # that navigation does not write the file on every call.  0 saves at once.
+    'session_save_delay': 1.0,
+
+    # opening a dataset records its access time in memory; it is written to
+    # the file this many seconds later, or at once if 0.  With
+    # track_access_time off, opening a dataset never writes to it.
+    'track_access_time': True,
+    'access_time_delay': 60,
+
+    # store numeric and string parameters of HDF5 datasets as plain HDF5
+    # attributes, rather than as urlencoded labrad data, so that other
+    # programs can read them.  Servers older than this option cannot.
+    'native_params': False,
+
+    # least number of seconds between data available signals for a dataset;
+    # listeners waiting in between are notified together.  0 sends at once.
+    'notify_interval': 0,
+}
+
+STORAGE_OPTIONS = ['chunk_rows', 'compression', 'shuffle']
+
+
 class SessionStore(object):
-    def __init__(self, datadir, hub):
-        self._sessions = weakref.WeakValueDictionary()
+    def __init__(self, datadir, hub, options=None):
         self.datadir = datadir
         self.hub = hub
+        self.options = dict(DEFAULT_OPTIONS)
+        self.options.update(options or {})
+        self.executor = backend.IOExecutor(self.options['io_threads'])
+        self.session_cache = util.LRUCache(self.options['session_cache_size'],
+                                           self.options['cache_max_age'])
+        self.dataset_cache = util.LRUCache(self.options['dataset_cache_size'],
+                                           self.options['cache_max_age'])
+        self._sessions = util.ObjectCache(self.session_cache)
+        backend.file_pool.max_open = self.options['max_open_files']
 
     def get_all(self):
         return list(self._sessions.values())
@@ -106,9 +172,11 @@ class SessionStore(object):
         Otherwise, create a new session instance.
         """
         path = tuple(path)
-        if path in self._sessions:
-            return self._sessions[path]
-        session = Session(self.datadir, path, self.hub, self)
+        session = self._sessions.get(path)
+        if session is not None:
+            return session
+        session = Session(self.datadir, path, self.hub, self, self.options,
+                          self.executor, self.dataset_cache)
         self._sessions[path] = session
         return session
 
@@ -119,15 +187,27 @@ class Session(object):
     One session object is created for each data directory accessed.
     The session object manages reading from and writing to the config
     file, and manages the datasets in this directory.
+
+    Updates to the access time are written to the config file after
+    session_save_delay seconds, so that a burst of calls causes one write.
+    New dataset numbers and tags are written right away.  A session that is
+    dropped before its save is due only loses the access time update.
     """
+    _unsaved = weakref.WeakSet() # sessions with changes waiting to be saved
 
-    def __init__(self, datadir, path, hub, session_store):
+    def __init__(self, datadir, path, hub, session_store, options=None,
+                 executor=None, dataset_cache=None, reactor=reactor):
         """Initialization that happens once when session object is created."""
         self.path = path
         self.hub = hub
+        self.options = DEFAULT_OPTIONS if options is None else options
+        self.reactor = reactor
+        self._saveCall = None
+        self.executor = backend.IOExecutor() if executor is None else executor
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(self.dir, 'session.ini')
-        self.datasets = weakref.WeakValueDictionary()
+        self.datasets = util.ObjectCache(dataset_cache, scope=tuple(path))
+        self._open_locks = {} # dataset name -> DeferredLock for opening it
 
         if not os.path.exists(self.dir):
             os.makedirs(self.dir)
@@ -136,16 +216,16 @@ class Session(object):
             parent_session = session_store.get(path[:-1])
             hub.onNewDir(path[-1], parent_session.listeners)
 
+        self.listeners = set()
         if os.path.exists(self.infofile):
             self.load()
+            self.access() # update current access time and save later
         else:
             self.counter = 1
-            self.created = self.modified = datetime.now()
+            self.created = self.modified = self.accessed = datetime.now()
             self.session_tags = {}
             self.dataset_tags = {}
-
-        self.access() # update current access time and save
-        self.listeners = set()
+            self.save()
 
     def load(self):
         """Load info from the session.ini file."""
@@ -189,11 +269,46 @@ class Session(object):
 
         with open(self.infofile, 'w') as f:
             S.write(f)
+        self._unsaved.discard(self)
+        if self._saveCall is not None:
+            if self._saveCall.active():
+                self._saveCall.cancel()
+            self._saveCall = None
 
     def access(self):
-        """Update last access time and save."""
+        """Update last access time and schedule a save."""
         self.accessed = datetime.now()
-        self.save()
+        self.changed()
+
+    def changed(self):
+        """Schedule a save of the session info."""
+        delay = self.options['session_save_delay']
+        if not delay:
+            self.save()
+            return
+        self._unsaved.add(self)
+        if self._saveCall is None:
+            # don't keep the session alive just to save its access time
+            self._saveCall = self.reactor.callLater(
+                    delay, Session._flushRef, weakref.ref(self))
+
+    @staticmethod
+    def _flushRef(ref):
+        session = ref()
+        if session is not None:
+            session._saveCall = None
+            session.flush()
+
+    def flush(self):
+        """Save the session info now if it has unsaved changes."""
+        if self in self._unsaved:
+            self.save()
+
+    @classmethod
+    def flush_all(cls):
+        """Save every session with unsaved changes, e.g. at shutdown."""
+        for session in list(cls._unsaved):
+            session.flush()
 
     def listContents(self, tagFilters):
         """Get a list of directory names in this directory."""
@@ -231,24 +346,42 @@ class Session(object):
                 filenames.append(filename_decode(base))
         return sorted(filenames)
 
-    def newDataset(self, title, independents, dependents, extended=False):
+    def newDataset(self, title, independents, dependents, extended=False,
+                   storage=None):
+        """Create a new dataset in this directory.
+
+        storage can override the server-wide chunk_rows, compression and
+        shuffle options for this dataset.
+        """
+        options = dict((k, self.options[k]) for k in STORAGE_OPTIONS)
+        options.update(storage or {})
+        backend.parse_compression(options['compression'])
+
         num = self.counter
         self.counter += 1
-        self.modified = datetime.now()
+        self.modified = self.accessed = datetime.now()
+        self.save() # never hand out the same number twice
 
         name = '%05d - %s' % (num, title)
         dataset = Dataset(self, name, title, create=True,
                           independents=independents,
                           dependents=dependents,
-                          extended=extended)
+                          extended=extended,
+                          storage=options,
+                          options=self.options,
+                          executor=self.executor)
         self.datasets[name] = dataset
-        self.access()
 
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
         return dataset
 
     def openDataset(self, name):
+        """Open a dataset by name or number.
+
+        If the I/O executor has worker threads, a dataset that is not open
+        yet is opened in a worker and a Deferred is returned.
+        """
         # first lookup by number if necessary
         if isinstance(name, int):
             for oldName in self.listDatasets():
@@ -265,15 +398,39 @@ class Session(object):
         if not (os.path.exists(file_base + '.csv') or os.path.exists(file_base + '.hdf5')):
             raise errors.DatasetNotFoundError(name)
 
+        dataset = self.datasets.get(name)
+        if dataset is not None:
+            dataset.access()
+            self.access()
+            return dataset
+
+        # need to create a new wrapper for this dataset
+        if self.executor.threads:
+            # opens of one file run one at a time; see _opened for duplicates
+            lock = self._open_locks.get(name)
+            if lock is None:
+                lock = self._open_locks[name] = defer.DeferredLock()
+            d = self.executor.submit(lock, backend.open_backend, file_base)
+            d.addBoth(self._openFinished, name, lock)
+            return d.addCallback(self._opened, name)
+        return self._opened(backend.open_backend(file_base), name)
+
+    def _openFinished(self, result, name, lock):
+        if not (lock.locked or lock.waiting) and self._open_locks.get(name) is lock:
+            del self._open_locks[name]
+        return result
+
+    def _opened(self, data, name):
         if name in self.datasets:
+            # opened by another request while this one was in a worker
+            data.close()
             dataset = self.datasets[name]
             dataset.access()
         else:
-            # need to create a new wrapper for this dataset
-            dataset = Dataset(self, name)
+            dataset = Dataset(self, name, options=self.options,
+                              executor=self.executor, data=data)
             self.datasets[name] = dataset
         self.access()
-
         return dataset
 
     def updateTags(self, tags, sessions, datasets):
@@ -311,11 +468,14 @@ class Session(object):
         sessUpdates = updateTagDict(tags, sessions, self.session_tags)
         dataUpdates = updateTagDict(tags, datasets, self.dataset_tags)
 
-        self.access()
+        self.accessed = datetime.now()
         if len(sessUpdates) + len(dataUpdates):
+            self.save()
             # fire a message about the new tags
             msg = (sessUpdates, dataUpdates)
             self.hub.onTagsUpdated(msg, self.listeners)
+        else:
+            self.changed()
 
     def getTags(self, sessions, datasets):
         sessTags = [(s, sorted(self.session_tags.get(s, []))) for s in sessions]
@@ -327,25 +487,74 @@ class Dataset(object):
     This object basically takes care of listeners and notifications.
     All the actual data or metadata access is proxied through to a
     backend object.
+
+    Added rows can be held in a write-behind buffer and written to the
+    backend in groups (see the flush_* options), so that many small adds
+    cost one write.  Reads flush the buffer first, so clients always see
+    every row that has been added.
+
+    Reads and writes of HDF5 data go through the I/O executor.  If it has
+    worker threads they run there, one at a time per dataset, and the
+    methods below return Deferreds; otherwise they run inline and return
+    their results directly.
     """
-    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False):
+    _buffered = weakref.WeakSet() # datasets with rows waiting to be written
+    _unsaved_access = weakref.WeakSet() # datasets with access times to write
+
+    def __init__(self, session, name, title=None, create=False, independents=[], dependents=[], extended=False,
+                 storage=None, options=None, reactor=reactor, executor=None, data=None):
         self.hub = session.hub
         self.name = name
+        self.options = DEFAULT_OPTIONS if options is None else options
+        self.reactor = reactor
+        self.executor = backend.IOExecutor() if executor is None else executor
+        self.io_lock = defer.DeferredLock() # serializes I/O on this dataset
         file_base = os.path.join(session.dir, filename_encode(name))
         self.listeners = set() # contexts that want to hear about added data
         self.param_listeners = set()
         self.comment_listeners = set()
+        self._buffer = [] # record arrays added but not yet written
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+        self._flush_call = None
+        self.row_streams = {} # context -> [next row, step] for pushing rows
+        self._notify_pending = set() # contexts waiting for a data available signal
+        self._notify_call = None
+        self._notified = None # when the last data available signal was sent
+        self._writing_rows = 0 # rows handed to the executor but not yet written
+        self._restored = 0 # rows put back in the buffer after failed writes
+        self._write_failures = 0 # failed writes in a row, see _writeFailed
+        self._access_call = None
+        self._grid = None # backend.Grid of the rows read so far, see getGrid
+        self._grid_call = None # drops _grid when get grid is not used for a while
 
         if create:
             indep = [self.makeIndependent(i, extended) for i in independents]
             dep = [self.makeDependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
+            self.data = backend.create_backend(file_base, title, indep, dep, extended,
+                                               **(storage or {}))
             self.save()
         else:
-            self.data = backend.open_backend(file_base)
+            self.data = data if data is not None else backend.open_backend(file_base)
             self.load()
             self.access()
 
+    def _io(self, func, *args, **kw):
+        """Run a blocking backend call, in the I/O thread pool if there is one.
+
+        Returns the result directly when the call runs inline, otherwise a
+        Deferred that fires with it.
+        """
+        if not (self.executor.threads and self.data.threadsafe):
+            return func(*args, **kw)
+        self.data.pin()
+        d = self.executor.submit(self.io_lock, func, *args, **kw)
+        return d.addBoth(self._unpin)
+
+    def _unpin(self, result):
+        self.data.unpin()
+        return result
+
     def save(self):
         self.data.save()
 
@@ -357,9 +566,43 @@ class Dataset(object):
         return '.'.join(str(x) for x in v)
 
     def access(self):
-        """Update time of last access for this dataset."""
-        self.data.access()
-        self.save()
+        """Update time of last access for this dataset.
+
+        The time is written to the file access_time_delay seconds later, so
+        that opening a dataset again and again causes at most one write.
+        With track_access_time off it is never written.
+        """
+        self.accessed = time.time()
+        if not self.options['track_access_time']:
+            return
+        delay = self.options['access_time_delay']
+        if not delay:
+            return self.saveAccess()
+        self._unsaved_access.add(self)
+        if self._access_call is None:
+            # don't keep the dataset alive just to save its access time
+            self._access_call = self.reactor.callLater(
+                    delay, Dataset._saveAccessRef, weakref.ref(self))
+
+    @staticmethod
+    def _saveAccessRef(ref):
+        dataset = ref()
+        if dataset is not None:
+            dataset._access_call = None
+            dataset.saveAccess()
+
+    def saveAccess(self):
+        """Write the last access time to the file now."""
+        if self._access_call is not None:
+            if self._access_call.active():
+                self._access_call.cancel()
+            self._access_call = None
+        self._unsaved_access.discard(self)
+        return self._io(self._writeAccess, self.accessed)
+
+    def _writeAccess(self, t):
+        self.data.access(t)
+        self.data.save()
 
     def makeIndependent(self, label, extended):
         """Add an independent variable to this dataset."""
@@ -393,8 +636,11 @@ class Dataset(object):
     def getTransposeType(self):
         return self.data.getTransposeType()
 
+    def storageInfo(self):
+        return self.data.storageInfo()
+
     def addParameter(self, name, data, saveNow=True):
-        self.data.addParam(name, data)
+        self.data.addParam(name, data, native=self.options['native_params'])
         if saveNow:
             self.save()
 
@@ -405,7 +651,7 @@ class Dataset(object):
 
     def addParameters(self, params, saveNow=True):
         for name, data in params:
-            self.data.addParam(name, data)
+            self.data.addParam(name, data, native=self.options['native_params'])
         if saveNow:
             self.save()
 
@@ -420,15 +666,281 @@ class Dataset(object):
         return self.data.getParamNames()
 
     def addData(self, data):
+        """Add rows to the dataset.
+
+        If buffering is enabled the rows are written once flush_rows rows or
+        flush_bytes bytes are waiting, or after flush_delay seconds,
+        whichever comes first.  Otherwise they are written right away.
+        Returns the result of flush() if the rows were written.  Without
+        buffering a failed write raises and none of the rows are kept;
+        with buffering it is retried, see _writeFailed.
+        """
+        self._buffer.append(data)
+        self._buffered_rows += len(data)
+        self._buffered_bytes += data.nbytes
+        if (self._buffered_rows >= self.options['flush_rows'] or
+                self._buffered_bytes >= self.options['flush_bytes']):
+            return self.flush()
+        elif self._flush_call is None:
+            self._buffered.add(self)
+            self._flush_call = self.reactor.callLater(
+                    self.options['flush_delay'], self.flush)
+
+    def flush(self):
+        """Write any buffered rows to the backend and notify listeners.
+
+        Returns a Deferred if the write was handed to a worker thread.
+        """
+        if self._flush_call is not None:
+            if self._flush_call.active():
+                self._flush_call.cancel()
+            self._flush_call = None
+        self._buffered.discard(self)
+        if not self._buffer:
+            return
+        if len(self._buffer) == 1:
+            data = self._buffer[0]
+        else:
+            data = np.concatenate(self._buffer)
+        self._buffer = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0
+        self._restored = 0
+        self._writing_rows += len(data)
         # append the data to the file
-        self.data.addData(data)
-
+        try:
+            result = self._io(self.data.addData, data)
+        except Exception:
+            if self._writeFailed(failure.Failure(), data) is not None:
+                raise
+            return
+        if isinstance(result, defer.Deferred):
+            return result.addCallbacks(self._written, self._writeFailed,
+                                       callbackArgs=(data,),
+                                       errbackArgs=(data,))
+        self._written(result, data)
+
+    def _written(self, result, data):
+        self._writing_rows -= len(data)
+        self._write_failures = 0
         # notify all listening contexts
-        self.hub.onDataAvailable(None, self.listeners)
+        self._notify(self.listeners)
         self.listeners = set()
+        self._pushRows()
+
+    def _notify(self, contexts):
+        """Tell contexts that there is data available.
+
+        Signals are sent at most once per notify_interval seconds; contexts
+        to notify in the meantime are collected and get one signal together.
+        """
+        interval = self.options['notify_interval']
+        if not interval:
+            self._sendNotify(contexts)
+            return
+        self._notify_pending.update(contexts)
+        if self._notify_call is not None:
+            return
+        now = self.reactor.seconds()
+        if self._notified is None or now - self._notified >= interval:
+            self._sendNotify()
+        else:
+            self._notify_call = self.reactor.callLater(
+                    self._notified + interval - now, self._sendNotify)
+
+    def _sendNotify(self, contexts=None):
+        self._notify_call = None
+        if contexts is None:
+            contexts, self._notify_pending = self._notify_pending, set()
+        self._notified = self.reactor.seconds()
+        self.hub.onDataAvailable(None, contexts)
+        self.hub.onRowCount(self.rowCount(), contexts)
+
+    def streamRows(self, context, pos, step=1):
+        """Push rows from pos on to context as they are written.
+
+        Rows are sent in the 'new rows' signal, with only every step-th row
+        included.  Replaces any earlier stream for the context.
+        """
+        self.row_streams[context] = [pos, max(step, 1)]
+        self._pushRows()
+
+    def stopStreamingRows(self, context):
+        """Stop pushing rows to context.
+
+        Returns the next row the context would have been sent, or None if
+        rows were not being pushed to it.
+        """
+        stream = self.row_streams.pop(context, None)
+        return None if stream is None else stream[0]
+
+    def _pushRows(self):
+        """Send the rows each stream has not seen yet.
+
+        Streams at the same position and step share one read and message.
+        """
+        if not self.row_streams:
+            return
+        end = self.data.rowCount()
+        groups = collections.defaultdict(list)
+        for context, stream in self.row_streams.items():
+            if stream[0] < end:
+                groups[tuple(stream)].append(context)
+                stream[0] = end
+        transpose = isinstance(self.data, backend.ExtendedHDF5Data)
+        for (pos, step), contexts in groups.items():
+            result = self._io(self.data.getData, end - pos, pos, transpose, False)
+            util.then(result, self._sendRows, pos, step, contexts, transpose)
+
+    def _sendRows(self, result, pos, step, contexts, transpose):
+        data, _ = result
+        if transpose:
+            columns = list(data)
+        else:
+            data = np.asarray(data)
+            columns = [data[:, i] for i in range(data.shape[1])] if data.size else []
+        offset = (-pos) % step # keep to rows whose index is a multiple of step
+        columns = tuple(col[offset::step] for col in columns)
+        if columns and len(columns[0]):
+            self.hub.onNewRows((pos + offset, columns), contexts)
+
+    def rowCount(self):
+        """Get the number of rows, including rows not written yet."""
+        return self.data.rowCount() + self._buffered_rows + self._writing_rows
+
+    def _writeFailed(self, reason, data):
+        """Handle a failed write of data; reason is the Failure.
+
+        Without buffering the error is returned to go back to the client
+        that added the rows, and the rows are not kept, so an add that
+        fails wrote nothing.  With buffering the client has already been
+        told the rows were added, so they are put back, in order, and
+        written again after flush_delay, until write_retries writes have
+        failed and they are dropped.
+        """
+        self._writing_rows -= len(data)
+        if not self.options['flush_rows']:
+            return reason
+        self._write_failures += 1
+        if self._write_failures > self.options['write_retries']:
+            log.msg('Dropping {} rows of dataset {} after {} failed writes: {}'.format(
+                    len(data), self.name, self._write_failures,
+                    reason.getErrorMessage()))
+            self._write_failures = 0
+            return None
+        log.msg('Writing {} rows of dataset {} failed, will retry: {}'.format(
+                len(data), self.name, reason.getErrorMessage()))
+        self._buffer.insert(self._restored, data)
+        self._restored += 1
+        self._buffered_rows += len(data)
+        self._buffered_bytes += data.nbytes
+        self._buffered.add(self)
+        if self._flush_call is None:
+            self._flush_call = self.reactor.callLater(
+                    self.options['flush_delay'], self.flush)
+        return None
+
+    @classmethod
+    def flush_all(cls):
+        """Write buffered rows and access times of every dataset.
+
+        Used at shutdown.
+        """
+        for dataset in list(cls._buffered):
+            dataset.flush()
+        for dataset in list(cls._unsaved_access):
+            dataset.saveAccess()
+
+    def _flushForRead(self):
+        """Write buffered rows before reading.
+
+        A failed write is logged rather than raised, so that readers do
+        not fail because of rows someone else added; the writer sees the
+        error from its own add or flush.
+        """
+        try:
+            result = self.flush()
+        except Exception:
+            log.err(None, 'Writing buffered rows of dataset {} failed'.format(self.name))
+            return
+        if isinstance(result, defer.Deferred):
+            result.addErrback(log.err, 'Writing buffered rows of dataset {} failed'.format(self.name))
 
     def getData(self, limit, start, transpose=False, simpleOnly=False):
-        return self.data.getData(limit, start, transpose, simpleOnly)
+        self._flushForRead()
+        return self._io(self.data.getData, limit, start, transpose, simpleOnly)
+
+    def getColumns(self, columns, start, stop=None, step=1):
+        """Get some columns of a range of rows; see HDF5Data.getColumns."""
+        self._flushForRead()
+        return self._io(self.data.getColumns, columns, start, stop, step)
+
+    def getDecimated(self, points, start, stop=None):
+        """Get at most points evenly spaced rows; see HDF5Data.getDecimated."""
+        self._flushForRead()
+        return self._io(self.data.getDecimated, points, start, stop)
+
+    def getWhere(self, column, low, high, columns):
+        """Get rows where low <= column <= high; see HDF5Data.getWhere."""
+        self._flushForRead()
+        return self._io(self.data.getWhere, column, low, high, columns)
+
+    def getGrid(self, fast=None):
+        """Get the rows of a raster scan as images; see backend.Grid.
+
+        The rows are kept between calls, so during a scan only the rows
+        added since the last call are read.  Like csv data they are kept
+        in memory for backend.DATA_TIMEOUT seconds after the last call, so
+        cached datasets do not hold on to every grid ever requested.  fast
+        picks the fast independent, otherwise it is detected from the data.
+        """
+        indep = len(self.getIndependents())
+        if indep != 2:
+            raise errors.NotAGridError(indep)
+        if fast not in (None, 0, 1):
+            raise errors.NoSuchColumnError(fast, indep)
+        dtype = self.data.dtype
+        for idx in range(len(dtype)):
+            if dtype[idx].shape or dtype[idx].kind not in 'biuf':
+                raise errors.UnsupportedColumnError(idx, dtype[idx], 'put on a grid')
+        if self._grid is None or (fast is not None and fast != self._grid.fast):
+            self._grid = backend.Grid(fast)
+        grid = self._grid
+        if self._grid_call is None:
+            self._grid_call = self.reactor.callLater(
+                    backend.DATA_TIMEOUT, self._dropGrid)
+        else:
+            self._grid_call.reset(backend.DATA_TIMEOUT)
+        result = self.getColumns(list(range(len(dtype))), grid.rows)
+        return util.then(result, self._gotGrid, grid, grid.rows)
+
+    def _gotGrid(self, columns, grid, start):
+        grid.add(start, columns)
+        return grid.get()
+
+    def _dropGrid(self):
+        self._grid_call = None
+        self._grid = None
+
+    def getSortedRange(self, column, low, high, columns):
+        """Get rows where low <= column < high; see HDF5Data.getSortedRange."""
+        self._flushForRead()
+        return self._io(self.data.getSortedRange, column, low, high, columns)
+
+    def getColumnStats(self):
+        """Get the row count and running column stats; see HDF5Data."""
+        self._flushForRead()
+        return self._io(self.data.getColumnStats)
+
+    def getEnvelope(self, points, start, stop=None):
+        """Get per-bucket min, max and mean; see HDF5Data.getEnvelope."""
+        self._flushForRead()
+        return self._io(self.data.getEnvelope, points, start, stop)
+
+    def hasMore(self, pos):
+        """Check whether there are rows after pos, including buffered rows."""
+        return (self._buffered_rows > 0 or self._writing_rows > 0 or
+                self.data.hasMore(pos))
 
     def keepStreaming(self, context, pos):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
@@ -445,10 +957,10 @@ class Dataset(object):
         #
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.hasMore(pos):
+        if self.hasMore(pos):
             if context in self.listeners:
                 self.listeners.remove(context)
-            self.hub.onDataAvailable(None, [context])
+            self._notify([context])
         else:
             self.listeners.add(context)
 
@@ -1,13 +1,19 @@
 import base64
+import bisect
 import collections
 import datetime
+import io
+import itertools
 import os
 import re
-import sys
+import threading
 import time
+import warnings
+import weakref
 
 import h5py
-from twisted.internet import reactor
+from twisted.internet import defer, reactor, threads
+from twisted.python import threadpool
 
 try:
     import numpy as np
@@ -30,8 +36,23 @@ TIME_FORMAT = '%Y-%m-%d, %H:%M:%S'
 PRECISION = 12 # digits of precision to use when saving data
 DATA_FORMAT = '%%.%dG' % PRECISION
 FILE_TIMEOUT_SEC = 60 # how long to keep datafiles open if not accessed
+MAX_OPEN_FILES = 256 # most datafiles kept open at once by a FilePool
 DATA_TIMEOUT = 300 # how long to keep data in memory if not accessed
+CSV_BLOCK_BYTES = 1 << 24 # text read and parsed at a time from csv files
+SIDECAR_SUFFIX = '.npy' # binary copy of csv data, next to the csv file
+SIDECAR_STAMP = np.dtype('<i8') # csv size and mtime_ns after the sidecar data
 DATA_URL_PREFIX = 'data:application/labrad;base64,'
+MIN_CAPACITY_ROWS = 64 # smallest preallocation when growing an HDF5 dataset
+COMPRESSION_FILTERS = ['gzip', 'lzf']
+ROW_COUNT_ATTR = 'Row Count' # logical number of rows in a preallocated dataset
+COMMENTS_NAME = 'Comments' # HDF5 dataset holding comments, next to 'DataVault'
+COMMENT_CHUNK_ROWS = 64
+ENVELOPE_BLOCK_ROWS = 1 << 16 # rows read at a time when computing envelopes
+STATS_ATTR = 'Column Stats' # min, max, sum, sum of squares, last and count per column
+STATS_ROWS_ATTR = 'Column Stats Rows' # number of rows included in STATS_ATTR
+STATS_BLOCK_ROWS = 1 << 16 # rows read at a time when catching up column stats
+ZONE_MAP_NAME = 'Zone Map' # HDF5 dataset of per-zone column min and max
+ZONE_ROWS = 4096 # rows per zone in a new zone map
 
 def time_to_str(t):
     return t.strftime(TIME_FORMAT)
@@ -57,6 +78,23 @@ def labrad_urlencode(data):
     data_url = DATA_URL_PREFIX + base64.urlsafe_b64encode(all_bytes).decode()
     return data_url
 
+def parse_compression(compression):
+    """Parse a compression spec like 'gzip', 'gzip:4' or 'lzf'.
+
+    Returns (filter, level) suitable for h5py's compression and
+    compression_opts arguments.  An empty spec means no compression.
+    """
+    if not compression:
+        return None, None
+    name, _, level = compression.partition(':')
+    if name not in COMPRESSION_FILTERS:
+        raise errors.BadStorageOptionError('compression', compression)
+    if not level:
+        return name, None
+    if name != 'gzip' or not level.isdigit() or int(level) > 9:
+        raise errors.BadStorageOptionError('compression', compression)
+    return name, int(level)
+
 def labrad_urldecode(data_url):
     if data_url.startswith(DATA_URL_PREFIX):
         if "b'" in data_url:
@@ -76,38 +114,233 @@ def labrad_urldecode(data_url):
         raise ValueError("Trying to labrad_urldecode data that doesn't start "
                          "with prefix: {}".format(DATA_URL_PREFIX))
 
+_io_thread = threading.local() # marks threads of an IOExecutor pool
+
+def in_io_thread():
+    """Check whether we are running in an IOExecutor worker thread."""
+    return getattr(_io_thread, 'active', False)
+
+class IOExecutor(object):
+    """Runs blocking backend calls in a pool of worker threads.
+
+    Calls submitted with the same lock run one at a time, in the order they
+    were submitted.  Each dataset has its own lock, so a file is only used by
+    one worker at a time while different files are read and written in
+    parallel.  With threads=0 there is no pool and callers should make their
+    calls directly on the reactor thread.
+    """
+    def __init__(self, threads=0, reactor=reactor):
+        self.threads = threads
+        self.reactor = reactor
+        self._pool = None
+        self._pending = set()
+
+    def submit(self, lock, func, *args, **kw):
+        """Run func(*args, **kw) in the pool once lock is free.
+
+        Returns a Deferred that fires on the reactor thread with the result.
+        """
+        if self._pool is None:
+            self._pool = threadpool.ThreadPool(0, self.threads, 'datavault-io')
+            self._pool.start()
+        d = lock.run(threads.deferToThreadPool, self.reactor, self._pool,
+                     self._call, func, args, kw)
+        self._pending.add(d)
+        d.addBoth(self._finished, d)
+        return d
+
+    def _call(self, func, args, kw):
+        _io_thread.active = True
+        return func(*args, **kw)
+
+    def _finished(self, result, d):
+        self._pending.discard(d)
+        return result
+
+    def stop(self):
+        """Wait for submitted calls to finish, then stop the worker threads."""
+        if self._pool is None:
+            return defer.succeed(None)
+        pool, self._pool = self._pool, None
+        d = defer.DeferredList(list(self._pending), consumeErrors=True)
+        d.addCallback(lambda _: pool.stop())
+        return d
+
+class FilePool(object):
+    """A bounded set of open files, closed in least recently used order.
+
+    SelfClosingFiles in a pool are closed when they have not been accessed
+    for their timeout, or when more than max_open files are open, in which
+    case the least recently used file that is not pinned is closed first.
+    A single timer sweeps the pool for idle files, rather than one timer per
+    file.  max_open=0 puts no limit on the number of open files.
+
+    Files may be accessed from IOExecutor worker threads, but they are only
+    ever closed on the reactor thread.
+    """
+    def __init__(self, max_open=MAX_OPEN_FILES, reactor=reactor):
+        self.max_open = max_open
+        self.reactor = reactor
+        self.hits = 0 # accesses to a file that was already open
+        self.misses = 0 # accesses that had to open the file
+        self.evictions = 0 # files closed to stay within max_open
+        self._lock = threading.Lock()
+        self._files = collections.OrderedDict() # open files, oldest first
+        self._sweepCall = None
+        self._sweepTime = None
+
+    def __len__(self):
+        return len(self._files)
+
+    def stats(self):
+        """Get a list of (name, value) counters for this pool."""
+        return [('open files', len(self._files)),
+                ('max open files', self.max_open),
+                ('file hits', self.hits),
+                ('file misses', self.misses),
+                ('file evictions', self.evictions)]
+
+    def accessed(self, f, hit):
+        """Record an access to f, from the reactor or a worker thread."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+                if f in self._files:
+                    self._files.move_to_end(f)
+            else:
+                self.misses += 1
+
+    def opened(self, f):
+        """Add a newly opened file to the pool.  Called on the reactor."""
+        with self._lock:
+            self._files[f] = None
+            self._files.move_to_end(f)
+        self._schedule(f._accessed + f.timeout)
+        if self.max_open:
+            self._evict(f)
+
+    def closed(self, f):
+        with self._lock:
+            self._files.pop(f, None)
+
+    def _evict(self, keep):
+        with self._lock:
+            excess = len(self._files) - self.max_open
+            victims = [f for f in self._files if not (f._pins or f is keep)]
+        for f in victims[:max(excess, 0)]:
+            self.evictions += 1
+            f.close()
+
+    def _schedule(self, when):
+        if self._sweepCall is not None and self._sweepTime <= when:
+            return
+        if self._sweepCall is not None and self._sweepCall.active():
+            self._sweepCall.cancel()
+        self._sweepTime = when
+        self._sweepCall = self.reactor.callLater(
+                max(when - self.reactor.seconds(), 0), self._sweep)
+
+    def _sweep(self):
+        """Close files that have been idle for their timeout."""
+        self._sweepCall = None
+        now = self.reactor.seconds()
+        with self._lock:
+            files = list(self._files)
+        expired = []
+        deadline = None
+        for f in files:
+            if f._pins:
+                when = now + f.timeout
+            else:
+                when = f._accessed + f.timeout
+                if when <= now:
+                    expired.append(f)
+                    continue
+            deadline = when if deadline is None else min(deadline, when)
+        for f in expired:
+            f.close()
+        if deadline is not None:
+            self._schedule(deadline)
+
+    def close_all(self):
+        """Close every file in the pool, e.g. at shutdown."""
+        with self._lock:
+            files = list(self._files)
+        for f in files:
+            f.close()
+
 class SelfClosingFile(object):
     """A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or when
+    its FilePool has too many files open.  Without a pool the file gets one
+    of its own, with no limit on open files.
+
+    The file may be used from IOExecutor worker threads.  Callers on the
+    reactor thread pin() the file around calls they hand to a worker, so
+    that it is not closed while the worker is using it.
     """
+    _open_files = weakref.WeakSet()
+
     def __init__(self, opener=open, open_args=(), open_kw={},
-                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor):
+                 timeout=FILE_TIMEOUT_SEC, touch=True, reactor=reactor,
+                 pool=None):
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
         self.reactor = reactor
+        self.pool = FilePool(max_open=0, reactor=reactor) if pool is None else pool
+        self._pins = 0
         if touch:
             self.__call__()
 
     def __call__(self):
-        if not hasattr(self, '_file'):
-            self._file = self.opener(*self.open_args, **self.open_kw)
-            self._fileTimeoutCall = self.reactor.callLater(
-                    self.timeout, self._fileTimeout)
+        # Only record the access time here; the pool checks it when it sweeps
+        # for idle files, so this is safe to call from a worker thread.
+        self._accessed = self.reactor.seconds()
+        if hasattr(self, '_file'):
+            self.pool.accessed(self, True)
+            return self._file
+        self.pool.accessed(self, False)
+        self._file = self.opener(*self.open_args, **self.open_kw)
+        if in_io_thread():
+            self.reactor.callFromThread(self._opened)
         else:
-            self._fileTimeoutCall.reset(self.timeout)
+            self._opened()
         return self._file
 
-    def _fileTimeout(self):
+    def _opened(self):
+        self._open_files.add(self)
+        self.pool.opened(self)
+
+    def close(self):
+        """Close the file now if it is open, running the close callbacks."""
+        if not hasattr(self, '_file'):
+            return
         for callback in self.callbacks:
             callback(self)
         self._file.close()
         del self._file
-        del self._fileTimeoutCall
+        self._open_files.discard(self)
+        self.pool.closed(self)
+
+    @classmethod
+    def close_all(cls):
+        """Close every file that is currently open, e.g. at shutdown."""
+        for f in list(cls._open_files):
+            f.close()
+
+    def pin(self):
+        """Open the file and keep it open until a matching unpin()."""
+        self._pins += 1
+        return self()
+
+    def unpin(self):
+        self._pins -= 1
+        self._accessed = self.reactor.seconds()
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -116,6 +349,114 @@ class SelfClosingFile(object):
         """Calls callback *before* the file is closes."""
         self.callbacks.append(callback)
 
+# open data files shared by all sessions; see SessionStore for max_open
+file_pool = FilePool()
+
+def _parse_csv(text):
+    """Parse complete lines of comma-separated floats into a 2-D array.
+
+    np.fromstring parses the whole block in C.  Anything it cannot parse,
+    such as blank lines, malformed values or lines with different numbers
+    of values, goes through np.loadtxt instead, which raises on bad data.
+    """
+    chars = np.frombuffer(text.encode(), dtype=np.uint8)
+    ends = np.flatnonzero(chars == ord('\n'))
+    commas = np.cumsum(chars == ord(','))[ends]
+    cols = commas[0] + 1
+    with warnings.catch_warnings(record=True) as caught:
+        # fromstring warns and stops early on text it cannot parse, which
+        # may leave a malformed last value looking like a complete row
+        warnings.simplefilter('always', DeprecationWarning)
+        try:
+            values = np.fromstring(text.replace('\n', ','), sep=',')
+        except ValueError: # newer numpy raises instead of warning
+            values = None
+    stopped_early = values is None or any(
+            issubclass(w.category, DeprecationWarning) for w in caught)
+    if (stopped_early or values.size != len(ends) * cols or
+            np.any(np.diff(commas) != cols - 1)):
+        return np.loadtxt(io.StringIO(text), delimiter=',', ndmin=2)
+    return values.reshape(len(ends), cols)
+
+def _read_csv(f, keep_partial=False):
+    """Read the rows from the current position of a csv file to its end.
+
+    The file is read and parsed CSV_BLOCK_BYTES at a time.  Returns a 2-D
+    array, or None if there are no rows.  With keep_partial, a last line
+    without a newline is taken to be still being written, and is left
+    unread for the next read.
+    """
+    blocks = []
+    rest = ''
+    while True:
+        text = f.read(CSV_BLOCK_BYTES)
+        if not text:
+            break
+        text = rest + text
+        end = text.rfind('\n') + 1
+        rest = text[end:]
+        if text[:end].strip():
+            blocks.append(_parse_csv(text[:end]))
+    if rest.strip() and not keep_partial:
+        blocks.append(_parse_csv(rest + '\n'))
+    elif rest:
+        f.seek(f.tell() - len(rest.encode()))
+    # blank lines parse to no rows, with a shape that does not concatenate
+    blocks = [block for block in blocks if len(block)]
+    if not blocks:
+        return None
+    return np.concatenate(blocks)
+
+def _csv_stamp(filename):
+    """Get the (size, mtime_ns) of a csv file that a sidecar must match."""
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime_ns
+
+def _load_sidecar(filename, size=0):
+    """Memory-map the binary copy of a csv file's data, if it is current.
+
+    The sidecar is a .npy file followed by the size and mtime of the csv
+    file it was made from.  Returns (data, size), where size is the bytes
+    of the csv file the data was read from, or None if there is no sidecar
+    or the csv file has changed since it was written.  A caller that knows
+    the first size bytes of the csv file are unchanged passes size to also
+    accept a sidecar of just those bytes.
+    """
+    sidecar = filename + SIDECAR_SUFFIX
+    try:
+        with open(sidecar, 'rb') as f:
+            f.seek(-2 * SIDECAR_STAMP.itemsize, os.SEEK_END)
+            stamp = tuple(np.fromfile(f, dtype=SIDECAR_STAMP, count=2))
+        current = _csv_stamp(filename)
+        if stamp != current and not (size and stamp[0] == size <= current[0]):
+            return None
+        return np.load(sidecar, mmap_mode='r'), int(stamp[0])
+    except (IOError, OSError, ValueError):
+        return None
+
+def _save_sidecar(filename, data, size):
+    """Save a binary copy of a csv file's data, see _load_sidecar.
+
+    data holds the rows in the first size bytes of the csv file.  Nothing
+    is saved unless that is the whole file, since the stamp would claim
+    rows that were never read.  Failures, such as a read-only directory,
+    are ignored: the sidecar only speeds up the next time the csv file is
+    read.
+    """
+    sidecar = filename + SIDECAR_SUFFIX
+    temp = sidecar + '.tmp'
+    try:
+        stamp = np.asarray(_csv_stamp(filename), dtype=SIDECAR_STAMP)
+        if stamp[0] != size:
+            return
+        with open(temp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data, dtype=np.float64))
+            stamp.tofile(f)
+        os.replace(temp, sidecar)
+    except (IOError, OSError):
+        if os.path.exists(temp):
+            os.remove(temp)
+
 class IniData(object):
     """Handles dataset metadata stored in INI files.
 
@@ -248,8 +589,12 @@ class IniData(object):
     def dtype(self):
         return np.dtype(','.join(['f8']*self.cols))
 
-    def access(self):
-        self.accessed = datetime.datetime.now()
+    def access(self, t=None):
+        """Set the access time to t, in seconds since the epoch, or now."""
+        if t is None:
+            self.accessed = datetime.datetime.now()
+        else:
+            self.accessed = datetime.datetime.fromtimestamp(t)
 
     def getIndependents(self):
         return self.independents
@@ -271,7 +616,8 @@ class IniData(object):
         type_tag = '({})'.format(','.join(units))
         return type_tag
 
-    def addParam(self, name, data):
+    def addParam(self, name, data, native=False):
+        """Add a parameter.  INI files store every parameter as text."""
         for p in self.parameters:
             if p['label'] == name:
                 raise errors.ParameterInUseError(name)
@@ -310,15 +656,21 @@ class CsvListData(IniData):
     Stores the entire contents of the file in memory as a list or numpy array
     """
 
+    # the in-memory data is managed with reactor timers, so all access to
+    # csv datasets stays on the reactor thread
+    threadsafe = False
+
     def __init__(self,
                  filename,
                  file_timeout=FILE_TIMEOUT_SEC,
                  data_timeout=DATA_TIMEOUT,
-                 reactor=reactor):
+                 reactor=reactor,
+                 pool=None):
         self.filename = filename
         self._file = SelfClosingFile(open_args=(filename, 'a+'),
                                      timeout=file_timeout,
-                                     reactor=reactor)
+                                     reactor=reactor,
+                                     pool=pool)
         self.timeout = data_timeout
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
@@ -327,6 +679,10 @@ class CsvListData(IniData):
     def file(self):
         return self._file()
 
+    def close(self):
+        """Close the underlying file."""
+        self._file.close()
+
     @property
     def version(self):
         return np.asarray([1,0,0], np.int32)
@@ -335,7 +691,8 @@ class CsvListData(IniData):
     def data(self):
         """Read data from file on demand.
 
-        The data is scheduled to be cleared from memory unless accessed."""
+        The data is scheduled to be cleared from memory unless accessed.
+        Only the part of the file after the rows already read is parsed."""
         if not hasattr(self, '_data'):
             self._data = []
             self._datapos = 0
@@ -345,8 +702,9 @@ class CsvListData(IniData):
             self._timeout_call.reset(DATA_TIMEOUT)
         f = self.file
         f.seek(self._datapos)
-        lines = f.readlines()
-        self._data.extend([float(n) for n in line.split(',')] for line in lines)
+        rows = _read_csv(f, keep_partial=True)
+        if rows is not None:
+            self._data.extend(rows.tolist())
         self._datapos = f.tell()
         return self._data
 
@@ -383,15 +741,84 @@ class CsvListData(IniData):
     def hasMore(self, pos):
         return pos < len(self.data)
 
+    def rowCount(self):
+        return len(self.data)
+
+    def _array(self, start, stop):
+        data = np.asarray(self.data, dtype=np.float64)
+        return data.reshape(-1, self.cols)[start:stop]
+
+    def getDecimated(self, points, start, stop=None):
+        """Get at most points rows from [start, stop); see HDF5Data."""
+        data = self._array(start, stop)
+        step = _bucket_rows(len(data), points)
+        return step, tuple(data[::step].T)
+
+    def getColumns(self, columns, start, stop=None, step=1):
+        """Get some columns of the rows in [start:stop:step]; see HDF5Data."""
+        for idx in columns:
+            if not 0 <= idx < self.cols:
+                raise errors.NoSuchColumnError(idx, self.cols)
+        data = self._array(start, stop)[::max(step, 1)]
+        return tuple(data[:, idx] for idx in columns)
+
+    def getEnvelope(self, points, start, stop=None):
+        """Get min, max and mean over buckets of rows; see HDF5Data."""
+        data = self._array(start, stop)
+        bucket_rows = _bucket_rows(len(data), points)
+        if not len(data):
+            return (bucket_rows,) + (np.zeros((0, self.cols)),) * 3
+        return (bucket_rows,) + _envelope(data, bucket_rows)
+
+    def getWhere(self, column, low, high, columns):
+        """Get rows where low <= column <= high; see HDF5Data.getWhere.
+
+        CSV data is held in memory, so this checks every row.
+        """
+        (key,) = self.getColumns([column], 0)
+        rows = np.flatnonzero((key >= low) & (key <= high))
+        return rows, tuple(col[rows] for col in self.getColumns(columns, 0))
+
+    def getSortedRange(self, column, low, high, columns):
+        """Get the rows where low <= column < high; see HDF5Data."""
+        (key,) = self.getColumns([column], 0)
+        start = int(np.searchsorted(key, low, 'left'))
+        stop = len(key) if high is None else int(np.searchsorted(key, high, 'left'))
+        return start, self.getColumns(columns, start, max(start, stop))
+
+    def getColumnStats(self):
+        """Get the row count and per-column stats; see HDF5Data.
+
+        CSV data is held in memory, so this is computed on each call.
+        """
+        data = self._array(0, None)
+        stats = _empty_stats(self.cols)
+        _update_stats(stats, data)
+        return _stats_result(len(data), stats)
+
+    def storageInfo(self):
+        """Get (chunk_rows, compression, shuffle, stored_bytes, data_bytes).
+
+        CSV files have no chunking or compression, so this reports the size
+        of the file against the size of the data as float64 values.
+        """
+        rows = len(self.data) if np.size(self.data) > 0 else 0
+        return 0, '', False, os.path.getsize(self.filename), rows * self.cols * 8
+
 class CsvNumpyData(CsvListData):
     """Data backed by a csv-formatted file.
 
     Stores the entire contents of the file in memory as a list or numpy array
     """
 
-    def __init__(self, filename, reactor=reactor):
+    _rows = 0 # valid rows at the start of _data
+    _datapos = 0 # bytes of the csv file in _data, kept when the data times out
+    _sidecarpos = 0 # bytes of the csv file in the sidecar
+
+    def __init__(self, filename, reactor=reactor, pool=None):
         self.filename = filename
-        self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor)
+        self._file = SelfClosingFile(open_args=(filename, 'a+'), reactor=reactor,
+                                     pool=pool)
         self.infofile = filename[:-4] + '.ini'
         self.reactor = reactor
 
@@ -402,7 +829,13 @@ class CsvNumpyData(CsvListData):
     def _get_data(self):
         """Read data from file on demand.
 
-        The data is scheduled to be cleared from memory unless accessed."""
+        The data is scheduled to be cleared from memory unless accessed.
+        Rows are kept in a buffer with spare capacity, see _appendRows, and
+        this returns a view of the valid rows.  After the csv file is parsed
+        a binary copy is saved next to it, and later reads memory-map that
+        copy for as long as the csv file is unchanged.  When the data times
+        out the copy is brought up to date, so the next read only parses
+        lines added to the csv file after that."""
         if not hasattr(self, '_data'):
             try:
                 # if the file is empty, this line can barf in certain versions
@@ -410,8 +843,7 @@ class CsvNumpyData(CsvListData):
                 # will be the case.  Even if the file exists on disk, we must
                 # check its size
                 if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=',')
+                    self._data = self._readData()
                 else:
                     self._data = np.array([[]])
                 if len(self._data.shape) == 1:
@@ -425,24 +857,77 @@ class CsvNumpyData(CsvListData):
                 # this error is raised by numpy 1.3
                 self.file.seek(0)
                 self._data = np.array([[]])
+            self._rows = len(self._data) if self._data.size > 0 else 0
             self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
         else:
             self._timeout_call.reset(DATA_TIMEOUT)
-        return self._data
+        if not self._rows:
+            return self._data
+        return self._data[:self._rows]
 
     def _set_data(self, data):
         self._data = data
+        self._rows = len(data) if data.size > 0 else 0
 
     data = property(_get_data, _set_data)
 
+    def _readData(self):
+        """Read the data from the sidecar and the csv file after it.
+
+        Rows read before the data timed out come from the sidecar, so only
+        the rest of the csv file is parsed.  Returns a 2-D array.
+        """
+        size = self._datapos if self._rows else 0
+        loaded = _load_sidecar(self.filename, size)
+        if loaded is not None and size and len(loaded[0]) != self._rows:
+            loaded = None
+        data, self._datapos = loaded or (None, 0)
+        self._sidecarpos = self._datapos
+        if self._file.size() > self._datapos:
+            f = self.file
+            f.seek(self._datapos)
+            rows = _read_csv(f)
+            self._datapos = f.tell()
+            if rows is not None:
+                data = rows if data is None else np.concatenate([data, rows])
+                _save_sidecar(self.filename, data, self._datapos)
+                self._sidecarpos = self._datapos
+        if data is None:
+            return np.array([[]])
+        return data
+
     def _on_timeout(self):
+        # _datapos and _rows are kept, and the sidecar holds the rows, so
+        # the next read only parses the lines added after them
+        if self._rows and self._sidecarpos != self._datapos:
+            _save_sidecar(self.filename, self._data[:self._rows], self._datapos)
+            self._sidecarpos = self._datapos
         del self._data
         del self._timeout_call
 
+    def _appendRows(self, rows):
+        """Append a 2-D array of rows to the data in memory.
+
+        The buffer grows geometrically, so appending one row at a time
+        does not copy all of the data on every call.
+        """
+        old_rows = len(self.data) if self.data.size > 0 else 0
+        new_rows = old_rows + len(rows)
+        if not old_rows or new_rows > len(self._data):
+            capacity = max(new_rows, 2 * old_rows, MIN_CAPACITY_ROWS)
+            data = np.empty((capacity, rows.shape[1]))
+            if old_rows:
+                data[:old_rows] = self._data[:old_rows]
+            self._data = data
+        self._data[old_rows:new_rows] = rows
+        self._rows = new_rows
+
     def _saveData(self, data):
         f = self.file
-        # always save with dos linebreaks (requires numpy 1.5.0 or greater)
-        np.savetxt(f, data, fmt=DATA_FORMAT, delimiter=',', newline='\r\n')
+        # always save with dos linebreaks.  This writes the same text as
+        # np.savetxt, which has a large overhead per call.
+        line = ','.join([DATA_FORMAT] * data.shape[1]) + '\r\n'
+        f.write(''.join(line % tuple(row) for row in data))
         f.flush()
 
     def addData(self, data):
@@ -452,14 +937,13 @@ class CsvNumpyData(CsvListData):
 
         # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
         record_data = util.from_record_array(data)
-        # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
+        if len(record_data):
+            self._appendRows(record_data)
 
         # append data to file
-        self._saveData(data)
+        self._saveData(record_data)
+        if hasattr(self, '_data'):
+            self._datapos = self.file.tell()
 
     def getData(self, limit, start, transpose, simpleOnly):
         if transpose:
@@ -479,8 +963,268 @@ class CsvNumpyData(CsvListData):
         if pos == 0:
             return os.path.getsize(self.filename) > 0
         else:
-            nrows = len(self.data) if self.data.size > 0 else 0
-            return pos < nrows
+            return pos < self.rowCount()
+
+    def rowCount(self):
+        return len(self.data) if self.data.size > 0 else 0
+
+class ColumnInfo(object):
+    """Column metadata of a dataset and the type tags derived from it.
+
+    Built once when the metadata is first read, since the columns of a
+    dataset never change, and not modified afterwards.
+    """
+    __slots__ = ('independents', 'dependents', 'row_type', 'transpose_type')
+
+    def __init__(self, independents, dependents):
+        self.independents = tuple(independents)
+        self.dependents = tuple(dependents)
+        columns = self.independents + self.dependents
+        self.row_type = '*({})'.format(','.join(
+                _column_type(col, transpose=False) for col in columns))
+        self.transpose_type = '({})'.format(','.join(
+                _column_type(col, transpose=True) for col in columns))
+
+def _column_type(col, transpose):
+    """Get the type tag of a column, as a row element or as a whole column."""
+    base_type = col.datatype
+    if base_type in ['v', 'c']:
+        unit_tag = '[{}]'.format(col.unit)
+    else:
+        unit_tag = ''
+    if transpose:
+        if len(col.shape) > 1:
+            shape_tag = '*{}'.format(len(col.shape) + 1)
+            comment = util.braced('N,' + ','.join(str(s) for s in col.shape))
+        elif col.shape[0] > 1:
+            shape_tag = '*2'
+            comment = util.braced('N,' + str(col.shape[0]))
+        else:
+            shape_tag = '*'
+            comment = ''
+    else:
+        if len(col.shape) > 1:
+            shape_tag = '*{}'.format(len(col.shape))
+            comment = util.braced(','.join(str(s) for s in col.shape))
+        elif col.shape[0] > 1:
+            shape_tag = '*'
+            comment = util.braced(str(col.shape[0]))
+        else:
+            shape_tag = ''
+            comment = ''
+    return shape_tag + base_type + unit_tag + comment
+
+def _native_param(data):
+    """Get data in a form h5py stores as a plain attribute.
+
+    Returns None if data needs to be stored as urlencoded labrad data.
+    """
+    if isinstance(data, (bool, float, complex)):
+        return data
+    if isinstance(data, int):
+        return data if -2**63 <= data < 2**63 else None
+    if isinstance(data, str):
+        # such a string would be read back as labrad data
+        return None if data.startswith(DATA_URL_PREFIX) else data
+    if (isinstance(data, np.ndarray) and data.size and
+            data.dtype.kind in 'biufc'):
+        return data
+    return None
+
+def _decode_param(value):
+    """Get the value of a parameter attribute, in either encoding."""
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        if value.startswith(DATA_URL_PREFIX):
+            return labrad_urldecode(value)
+        return value
+    if isinstance(value, np.ndarray) and value.ndim:
+        return value
+    return value.item()
+
+def _bucket_rows(rows, points):
+    """Get the rows per bucket that split rows into at most points buckets."""
+    if points < 1:
+        raise errors.NoPointsError(points)
+    return max(-(-rows // points), 1)
+
+def _envelope(data, bucket_rows):
+    """Get the per-bucket min, max and mean of the rows of a 2-D array."""
+    starts = np.arange(0, len(data), bucket_rows)
+    counts = np.diff(np.append(starts, len(data)))
+    mins = np.minimum.reduceat(data, starts, axis=0)
+    maxs = np.maximum.reduceat(data, starts, axis=0)
+    means = np.add.reduceat(data, starts, axis=0) / counts[:, np.newaxis]
+    return mins, maxs, means
+
+def _empty_stats(cols):
+    """Get column stats for no rows; see HDF5Data.getColumnStats."""
+    stats = np.full((6, cols), np.nan)
+    stats[2:4] = 0
+    stats[5] = 0
+    return stats
+
+def _stats_result(rows, stats):
+    """Get the result of getColumnStats from the row count and stats."""
+    return (rows,) + tuple(stats[:5].copy()) + (stats[5].astype(np.int64),)
+
+def _stats_values(data, dtype):
+    """Get the rows of a struct array as a 2-D float array for column stats.
+
+    Columns that are not real scalars in dtype are NaN.  Returns None if
+    data is not a struct array with the columns of dtype.
+    """
+    names = getattr(data, 'dtype', np.dtype(float)).names
+    if names is None or len(names) != len(dtype):
+        return None
+    values = np.full((len(data), len(dtype)), np.nan)
+    for idx, name in enumerate(names):
+        col_type = dtype[idx]
+        if not col_type.shape and col_type.kind in 'biuf':
+            values[:, idx] = data[name]
+    return values
+
+def _update_stats(stats, values):
+    """Add the rows of a 2-D float array to column stats, in place.
+
+    NaNs are left out of the min and max, and only finite values are
+    included in the sums and counted.
+    """
+    if not len(values):
+        return
+    finite = np.isfinite(values)
+    values_or_zero = np.where(finite, values, 0)
+    stats[0] = np.fmin(stats[0], np.fmin.reduce(values, axis=0))
+    stats[1] = np.fmax(stats[1], np.fmax.reduce(values, axis=0))
+    stats[2] += values_or_zero.sum(axis=0)
+    stats[3] += (values_or_zero * values_or_zero).sum(axis=0)
+    stats[4] = values[-1]
+    stats[5] += finite.sum(axis=0)
+
+def _update_zones(zones, start, values, zone_rows):
+    """Add rows to the per-zone min and max of each column.
+
+    zones is a (zones, 2, columns) array of mins and maxs, and values holds
+    the rows starting at row start as a 2-D float array.  Returns zones,
+    which is a new array if it had to grow.
+    """
+    if not len(values):
+        return zones
+    stop = start + len(values)
+    count = -(-stop // zone_rows)
+    if count > len(zones):
+        grown = np.full((max(count, 2 * len(zones)),) + zones.shape[1:], np.nan)
+        grown[:len(zones)] = zones
+        zones = grown
+    first = start // zone_rows
+    bounds = np.arange((first + 1) * zone_rows, stop, zone_rows) - start
+    starts = np.concatenate(([0], bounds)).astype(np.intp)
+    idx = np.arange(first, first + len(starts))
+    zones[idx, 0] = np.fmin(zones[idx, 0], np.fmin.reduceat(values, starts, axis=0))
+    zones[idx, 1] = np.fmax(zones[idx, 1], np.fmax.reduceat(values, starts, axis=0))
+    return zones
+
+def _select_rows(columns, mask):
+    """Get the entries of each column (array or list) where mask is set."""
+    return tuple(col[mask] if isinstance(col, np.ndarray)
+                 else [x for x, m in zip(col, mask) if m]
+                 for col in columns)
+
+class Grid(object):
+    """The rows of a raster scan reshaped into 2-D images.
+
+    The scan has two independents.  The fast one steps through the same
+    values on every line of the scan, while the slow one stays the same
+    along a line.  Rows are kept as they are added, so a grid updated
+    during a scan only needs the rows added since the last update.
+    """
+
+    def __init__(self, fast=None):
+        self.fast = fast # index of the fast independent, None to detect it
+        self.line = 0 # points per line, 0 until the first line is complete
+        self.rows = 0
+        self._columns = None # one float64 array per column, with spare capacity
+
+    def add(self, start, columns):
+        """Add rows from row start on, given as one array per column.
+
+        Rows that were already added are skipped.
+        """
+        skip = self.rows - start
+        columns = [np.asarray(col, dtype=np.float64)[skip:] for col in columns]
+        if self._columns is None:
+            self._columns = [np.zeros(0) for col in columns]
+        new_rows = len(columns[0]) if columns else 0
+        rows = self.rows + new_rows
+        if rows > len(self._columns[0]):
+            capacity = max(rows, 2 * len(self._columns[0]))
+            for idx, old in enumerate(self._columns):
+                self._columns[idx] = np.empty(capacity)
+                self._columns[idx][:self.rows] = old[:self.rows]
+        for buf, col in zip(self._columns, columns):
+            buf[self.rows:rows] = col
+        self.rows = rows
+        if not rows:
+            return
+        if self.fast is None:
+            changed = [np.flatnonzero(col[1:rows] != col[0])[:1]
+                       for col in self._columns[:2]]
+            if len(changed[0]) or len(changed[1]):
+                # the fast independent changes first; if both change, take 0
+                first = min(c[0] for c in changed if len(c))
+                self.fast = 1 if first not in changed[0] else 0
+        if self.fast is not None and not self.line:
+            slow = self._columns[1 - self.fast][:rows]
+            changes = np.flatnonzero(slow != slow[0])
+            if len(changes):
+                self.line = int(changes[0])
+
+    def get(self):
+        """Get (fast, fast values, slow values, images).
+
+        fast is the index of the fast independent, and the values are
+        those of the first line and of each line.  images holds one 2-D
+        array per dependent with one row per line; points not measured
+        yet are NaN.  Until the first line is complete the grid is that
+        one line.
+        """
+        fast = 0 if self.fast is None else self.fast
+        deps = len(self._columns) - 2 if self._columns else 0
+        if not self.rows:
+            return fast, np.zeros(0), np.zeros(0), np.zeros((deps, 0, 0))
+        line = self.line or self.rows
+        lines = -(-self.rows // line)
+        columns = [col[:self.rows] for col in self._columns]
+        images = np.full((deps, lines * line), np.nan)
+        for image, col in zip(images, columns[2:]):
+            image[:self.rows] = col
+        return (fast, columns[fast][:line], columns[1 - fast][::line],
+                images.reshape(deps, lines, line))
+
+class _SortedColumn(object):
+    """One column of an HDF5 dataset as a sequence for the bisect module.
+
+    Each item is read from the file when it is needed, so a binary search
+    reads only about log2(rows) values, and only the one field of each row.
+    """
+
+    def __init__(self, dataset, name, rows):
+        self.dataset = dataset
+        self.name = name
+        self.rows = rows
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, idx):
+        return self.dataset[idx, self.name]
+
+def _decode(s):
+    """Get a str from a string read from an HDF5 file, which may be bytes."""
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+    return str(s)
 
 class HDF5MetaData(object):
     """Class to store metadata inside the file itself.
@@ -491,6 +1235,10 @@ class HDF5MetaData(object):
     this version works.
     """
 
+    _columns = None # ColumnInfo, read from the file on first use
+    _params = None # see _paramIndex
+    _paramValues = None # decoded parameters by name
+
     comment_type = [
         ('Timestamp', np.float64),
         ('User', h5py.special_dtype(vlen=str)),
@@ -512,6 +1260,7 @@ class HDF5MetaData(object):
     def initialize_info(self, title, indep, dep):
         """Initializes the metadata for a newly created dataset."""
         t = time.time()
+        self._columns = None
 
         attrs = self.dataset.attrs
         attrs['Title'] = title
@@ -535,100 +1284,96 @@ class HDF5MetaData(object):
             attrs[prefix + 'datatype'] = d.datatype
             attrs[prefix + 'unit'] = d.unit
 
-    def access(self):
-        self.dataset.attrs['Access Time'] = time.time()
+    def access(self, t=None):
+        """Set the access time to t, in seconds since the epoch, or now."""
+        self.dataset.attrs['Access Time'] = time.time() if t is None else t
+
+    def _columnInfo(self):
+        """Get the column metadata, reading it from the file the first time."""
+        if self._columns is None:
+            attrs = self.dataset.attrs
+            keys = set(attrs.keys())
+            indep = []
+            for idx in itertools.count():
+                prefix = 'Independent{}.'.format(idx)
+                if prefix + 'label' not in keys:
+                    break
+                indep.append(Independent(attrs[prefix + 'label'],
+                                         attrs[prefix + 'shape'],
+                                         attrs[prefix + 'datatype'],
+                                         attrs[prefix + 'unit']))
+            dep = []
+            for idx in itertools.count():
+                prefix = 'Dependent{}.'.format(idx)
+                if prefix + 'label' not in keys:
+                    break
+                dep.append(Dependent(attrs[prefix + 'label'],
+                                     attrs[prefix + 'legend'],
+                                     attrs[prefix + 'shape'],
+                                     attrs[prefix + 'datatype'],
+                                     attrs[prefix + 'unit']))
+            self._columns = ColumnInfo(indep, dep)
+        return self._columns
 
     def getIndependents(self):
-        attrs = self.dataset.attrs
-        rv = []
-        for idx in range(sys.maxsize):
-            prefix = 'Independent{}.'.format(idx)
-            key = prefix + 'label'
-            if key in attrs:
-                label = attrs[prefix + 'label']
-                shape = attrs[prefix + 'shape']
-                datatype = attrs[prefix + 'datatype']
-                unit = attrs[prefix + 'unit']
-                rv.append(Independent(label, shape, datatype, unit))
-            else:
-                return rv
+        return list(self._columnInfo().independents)
 
     def getDependents(self):
-        attrs = self.dataset.attrs
-        rv = []
-        for idx in range(sys.maxsize):
-            prefix = 'Dependent{}.'.format(idx)
-            key = prefix + 'label'
-            if key in attrs:
-                label = attrs[prefix + 'label']
-                legend = attrs[prefix + 'legend']
-                shape = attrs[prefix + 'shape']
-                datatype = attrs[prefix + 'datatype']
-                unit = attrs[prefix + 'unit']
-                rv.append(Dependent(label, legend, shape, datatype, unit))
-            else:
-                return rv
+        return list(self._columnInfo().dependents)
 
     def getRowType(self):
-        column_types = []
-        for col in self.getIndependents() + self.getDependents():
-            base_type = col.datatype
-            if base_type in ['v', 'c']:
-                unit_tag = '[{}]'.format(col.unit)
-            else:
-                unit_tag = ''
-            if len(col.shape) > 1:
-                shape_tag = '*{}'.format(len(col.shape))
-                comment = util.braced(','.join(str(s) for s in col.shape))
-            elif col.shape[0] > 1:
-                shape_tag = '*'
-                comment = util.braced(str(col.shape[0]))
-            else:
-                shape_tag = ''
-                comment = ''
-            column_types.append(shape_tag + base_type + unit_tag + comment)
-        type_tag = '*({})'.format(','.join(column_types))
-        return type_tag
+        return self._columnInfo().row_type
 
     def getTransposeType(self):
-        column_type = []
-        for col in self.getIndependents() + self.getDependents():
-            base_type = col.datatype
-            if base_type in ['v', 'c']:
-                unit_tag = '[{}]'.format(col.unit)
-            else:
-                unit_tag = ''
-            if len(col.shape) > 1:
-                shape_tag = '*{}'.format(len(col.shape) + 1)
-                comment = util.braced('N,' + ','.join(str(s) for s in col.shape))
-            elif col.shape[0] > 1:
-                shape_tag = '*2'
-                comment = util.braced('N,' + str(col.shape[0]))
-            else:
-                shape_tag = '*'
-                comment = ''
-            column_type.append(shape_tag + base_type + unit_tag + comment)
-        type_tag = '({})'.format(','.join(column_type))
-        return type_tag
+        return self._columnInfo().transpose_type
+
+    def _paramIndex(self):
+        """Get the parameter names, in file order, and a map from lower case.
 
-    def addParam(self, name, data):
+        Read from the file on first use and again after addParam.
+        """
+        if self._params is None:
+            names = collections.OrderedDict(
+                    (str(k[6:]), None) for k in self.dataset.attrs
+                    if k.startswith('Param.'))
+            lower = {}
+            for n in names:
+                lower.setdefault(n.lower(), n)
+            self._params = names, lower
+        return self._params
+
+    def addParam(self, name, data, native=False):
+        """Add a parameter.
+
+        With native=True, numbers, strings and numeric arrays are stored as
+        plain HDF5 attributes that other programs can read directly.  Other
+        values are always stored as urlencoded labrad data.
+        """
         keyname = 'Param.{}'.format(name)
         if keyname in self.dataset.attrs:
             raise errors.ParameterInUseError(name)
-        value = labrad_urlencode(data)
+        value = _native_param(data) if native else None
+        if value is None:
+            value = labrad_urlencode(data)
         self.dataset.attrs[keyname] = value
+        self._params = None
 
     def getParameter(self, name, case_sensitive=True):
-        """Get a parameter from the dataset."""
-        keyname = 'Param.{}'.format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
-        raise errors.BadParameterError(name)
+        """Get a parameter from the dataset.
+
+        Values are decoded once and then kept in memory.
+        """
+        names, lower = self._paramIndex()
+        if not case_sensitive:
+            name = lower.get(name.lower(), name)
+        if name not in names:
+            raise errors.BadParameterError(name)
+        if self._paramValues is None:
+            self._paramValues = {}
+        if name not in self._paramValues:
+            raw = self.dataset.attrs['Param.{}'.format(name)]
+            self._paramValues[name] = _decode_param(raw)
+        return self._paramValues[name]
 
     def getParamNames(self):
         """Get the names of all dataset parameters.
@@ -636,30 +1381,447 @@ class HDF5MetaData(object):
         Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
         conflicts with the other metadata.
         """
-        names = [str(k[6:]) for k in self.dataset.attrs if k.startswith('Param.')]
-        return names
+        names, _ = self._paramIndex()
+        return list(names)
+
+    def _comments(self):
+        """Get the stored comments, without reading them all.
+
+        Comments are kept in a resizable 'Comments' dataset.  Files written
+        before that keep them in the 'Comments' attribute of the DataVault
+        dataset, which is returned instead until a comment is added.
+        """
+        group = self.dataset.parent
+        if COMMENTS_NAME in group:
+            return group[COMMENTS_NAME]
+        return self.dataset.attrs['Comments']
+
+    def _commentsDataset(self):
+        """Get the 'Comments' dataset, moving old comments into it if needed."""
+        group = self.dataset.parent
+        if COMMENTS_NAME in group:
+            return group[COMMENTS_NAME]
+        old_comments = self.dataset.attrs['Comments']
+        comments = group.create_dataset(COMMENTS_NAME, data=old_comments,
+                                        dtype=self.comment_type,
+                                        maxshape=(None,),
+                                        chunks=(COMMENT_CHUNK_ROWS,))
+        # leave the attribute empty so older servers still open the file
+        self.dataset.attrs.create('Comments', np.ndarray((0,), dtype=self.comment_type))
+        return comments
 
     def addComment(self, user, comment):
         """Add a comment to the dataset."""
         t = time.time()
-        new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
-        old_comments = self.dataset.attrs['Comments']
-        data = np.hstack((old_comments, new_comment))
-        self.dataset.attrs.create('Comments', data, dtype=self.comment_type)
+        comments = self._commentsDataset()
+        n = comments.shape[0]
+        comments.resize((n + 1,))
+        comments[n] = (t, user, comment)
 
     def getComments(self, limit, start):
         """Get comments in [(datetime, username, comment), ...] format."""
         if limit is None:
-            raw_comments = self.dataset.attrs['Comments'][start:]
+            raw_comments = self._comments()[start:]
         else:
-            raw_comments = self.dataset.attrs['Comments'][start:start+limit]
-        comments = [(datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2])) for c in raw_comments]
+            raw_comments = self._comments()[start:start+limit]
+        comments = [(datetime.datetime.fromtimestamp(c[0]), _decode(c[1]), _decode(c[2]))
+                    for c in raw_comments]
         return comments, start+len(comments)
 
     def numComments(self):
-        return len(self.dataset.attrs['Comments'])
+        return len(self._comments())
+
+class HDF5Data(HDF5MetaData):
+    """Row storage shared by the simple and extended HDF5 formats.
+
+    Rows are appended into a dataset that is grown geometrically, so that
+    appending one row at a time does not resize the dataset on every call.
+    The number of valid rows is kept in memory while the file is open, and
+    written to the 'Row Count' file attribute when the capacity grows.  The
+    unused capacity is trimmed off and the attribute removed when the file
+    is closed, so readers that only look at the dataset shape still see the
+    correct data.
+    """
+
+    threadsafe = True # may be used from an IOExecutor worker thread
+
+    _rows = None # valid rows while the file is open, None until read
+    _stats = None # running column stats, see getColumnStats
+    _statsRows = 0 # rows included in _stats
+    _statsSaved = True
+    _zones = None # per-zone mins and maxs, see getWhere
+    _zoneRows = ZONE_ROWS # rows per zone
+    _zonesIndexed = 0 # rows included in _zones
+    _zonesSaved = True
+    _zoneMapChecked = False # looked for a zone map saved in the file
+
+    def __init__(self, fh):
+        self._file = fh
+        fh.onClose(self._trim)
+        fh.onClose(self._saveStats)
+        fh.onClose(self._saveZones)
+
+    @property
+    def file(self):
+        return self._file()
+
+    def close(self):
+        """Close the underlying file."""
+        self._file.close()
+
+    def pin(self):
+        """Keep the file open while a worker thread uses this dataset."""
+        self._file.pin()
+
+    def unpin(self):
+        self._file.unpin()
+
+    @property
+    def dataset(self):
+        return self.file["DataVault"]
+
+    def _createDataset(self, dtype, chunk_rows=0, compression='', shuffle=False):
+        """Create the resizable DataVault dataset with the given layout.
+
+        chunk_rows of 0 lets h5py pick the chunk size.  compression is a spec
+        accepted by parse_compression.
+        """
+        compression, level = parse_compression(compression)
+        chunks = (chunk_rows,) if chunk_rows else True
+        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,),
+                                 chunks=chunks, compression=compression,
+                                 compression_opts=level, shuffle=shuffle)
+
+    def storageInfo(self):
+        """Get (chunk_rows, compression, shuffle, stored_bytes, data_bytes).
+
+        stored_bytes is the space allocated on disk for the dataset, while
+        data_bytes is the uncompressed size of the valid rows.
+        """
+        dataset = self.dataset
+        compression = dataset.compression or ''
+        if dataset.compression_opts is not None:
+            compression += ':{}'.format(dataset.compression_opts)
+        chunk_rows = dataset.chunks[0] if dataset.chunks else 0
+        return (chunk_rows, compression, dataset.shuffle,
+                dataset.id.get_storage_size(), len(self) * dataset.dtype.itemsize)
+
+    def _appendRows(self, data):
+        """Append rows to the dataset, growing its capacity if needed.
+
+        The row count is only written to the file when the capacity grows,
+        not on every append; see _trim.
+        """
+        f = self.file
+        dataset = f['DataVault']
+        new_rows = len(data)
+        old_rows = len(self)
+        rows = old_rows + new_rows
+        capacity = dataset.shape[0]
+        if rows > capacity:
+            capacity = max(rows, 2 * capacity, MIN_CAPACITY_ROWS)
+            dataset.resize((capacity,))
+            f.attrs[ROW_COUNT_ATTR] = rows
+        dataset[old_rows:rows] = data
+        self._rows = rows
+        if self._stats is None:
+            self._loadStats()
+        if self._zones is None and not self._zoneMapChecked:
+            self._zoneMapChecked = True
+            if ZONE_MAP_NAME in f:
+                self._loadZones()
+        update_stats = self._statsRows == old_rows
+        update_zones = self._zones is not None and self._zonesIndexed == old_rows
+        values = None
+        if update_stats or update_zones:
+            values = _stats_values(data, dataset.dtype)
+        # otherwise getColumnStats and getWhere read these rows back to catch up
+        if values is not None and update_stats:
+            _update_stats(self._stats, values)
+            self._statsRows += new_rows
+            self._statsSaved = False
+        if values is not None and update_zones:
+            self._zones = _update_zones(self._zones, old_rows, values, self._zoneRows)
+            self._zonesIndexed += new_rows
+            self._zonesSaved = False
+
+    def _loadStats(self):
+        """Read the column stats saved in the file, if they are usable."""
+        attrs = self.file.attrs
+        cols = len(self.dataset.dtype)
+        self._stats = _empty_stats(cols)
+        self._statsRows = 0
+        if STATS_ATTR in attrs and STATS_ROWS_ATTR in attrs:
+            stats = np.asarray(attrs[STATS_ATTR], dtype=np.float64)
+            rows = int(attrs[STATS_ROWS_ATTR])
+            if stats.shape == self._stats.shape and rows <= len(self):
+                self._stats = stats
+                self._statsRows = rows
+        self._statsSaved = True
+
+    def _saveStats(self, fh):
+        """Save the column stats to the file before it is closed."""
+        if self._statsSaved:
+            return
+        attrs = fh().attrs
+        attrs[STATS_ATTR] = self._stats
+        attrs[STATS_ROWS_ATTR] = self._statsRows
+        self._statsSaved = True
+
+    def _loadZones(self):
+        """Read the zone map from the file, or start an empty one."""
+        f = self.file
+        cols = len(self.dataset.dtype)
+        self._zones = np.full((0, 2, cols), np.nan)
+        self._zoneRows = ZONE_ROWS
+        self._zonesIndexed = 0
+        if ZONE_MAP_NAME in f:
+            zone_map = f[ZONE_MAP_NAME]
+            indexed = int(zone_map.attrs['Indexed Rows'])
+            if zone_map.shape[1:] == (2, cols) and indexed <= len(self):
+                self._zones = zone_map[...]
+                self._zoneRows = int(zone_map.attrs['Zone Rows'])
+                self._zonesIndexed = indexed
+        self._zonesSaved = True
+
+    def _saveZones(self, fh):
+        """Save the zone map to the file before it is closed."""
+        if self._zonesSaved:
+            return
+        f = fh()
+        count = -(-self._zonesIndexed // self._zoneRows)
+        zones = self._zones[:count]
+        if not zones.size:
+            return
+        if ZONE_MAP_NAME in f:
+            zone_map = f[ZONE_MAP_NAME]
+            zone_map.resize(zones.shape)
+            zone_map[...] = zones
+        else:
+            zone_map = f.create_dataset(ZONE_MAP_NAME, data=zones,
+                                        maxshape=(None,) + zones.shape[1:],
+                                        chunks=True)
+        zone_map.attrs['Zone Rows'] = self._zoneRows
+        zone_map.attrs['Indexed Rows'] = self._zonesIndexed
+        self._zonesSaved = True
+
+    def getWhere(self, column, low, high, columns):
+        """Get the rows where low <= column <= high.
+
+        column must be a real scalar column.  Returns (rows, values), where
+        rows holds the index of each matching row and values one array (or
+        list, for string columns) per entry of columns, as getColumns.
+
+        The file keeps the min and max of every column over each zone of
+        _zoneRows rows.  Only runs of zones that can hold matching rows
+        are read, so a search on a swept variable reads a small part of
+        the data.  The zone map is built the first time a dataset is
+        searched, then kept up to date as rows are added.
+        """
+        dtype = self.dataset.dtype
+        for idx in [column] + list(columns):
+            if not 0 <= idx < len(dtype):
+                raise errors.NoSuchColumnError(idx, len(dtype))
+        col_type = dtype[column]
+        if col_type.shape or col_type.kind not in 'biuf':
+            raise errors.UnsupportedColumnError(column, col_type, 'searched by range')
+        if self._zones is None:
+            self._loadZones()
+        rows = len(self)
+        zone_rows = self._zoneRows
+        block_rows = max(STATS_BLOCK_ROWS // zone_rows, 1) * zone_rows
+        for pos in range(self._zonesIndexed, rows, block_rows):
+            block = self.dataset[pos:min(pos + block_rows, rows)]
+            self._zones = _update_zones(self._zones, pos,
+                                        _stats_values(block, dtype), zone_rows)
+            self._zonesIndexed += len(block)
+            self._zonesSaved = False
+        count = -(-rows // zone_rows)
+        zones = self._zones[:count, :, column]
+        hits = np.flatnonzero((zones[:, 0] <= high) & (zones[:, 1] >= low))
+        found = []
+        results = []
+        # read each run of adjacent zones at once
+        for run in np.split(hits, np.flatnonzero(np.diff(hits) != 1) + 1):
+            if not len(run):
+                continue
+            start = run[0] * zone_rows
+            stop = min((run[-1] + 1) * zone_rows, rows)
+            data = self.getColumns([column] + list(columns), start, stop)
+            mask = (data[0] >= low) & (data[0] <= high)
+            found.append(start + np.flatnonzero(mask))
+            results.append(_select_rows(data[1:], mask))
+        if not found:
+            empty = self.getColumns(list(columns), 0, 0)
+            return np.zeros((0,), dtype=np.int64), empty
+        values = []
+        for parts in zip(*results):
+            if isinstance(parts[0], np.ndarray):
+                values.append(np.concatenate(parts))
+            else:
+                values.append([x for part in parts for x in part])
+        return np.concatenate(found), tuple(values)
+
+    def getSortedRange(self, column, low, high, columns):
+        """Get the rows where low <= column < high, for a sorted column.
+
+        column must be a real scalar column whose values never decrease,
+        such as the timestamp of a log.  The range is found by binary
+        search, reading one row at a time, so only the matching rows are
+        read in full.  high of None means no upper limit.  Returns
+        (start, values), where start is the index of the first matching
+        row and values holds the given columns, as getColumns.
+        """
+        dtype = self.dataset.dtype
+        for idx in [column] + list(columns):
+            if not 0 <= idx < len(dtype):
+                raise errors.NoSuchColumnError(idx, len(dtype))
+        col_type = dtype[column]
+        if col_type.shape or col_type.kind not in 'biuf':
+            raise errors.UnsupportedColumnError(column, col_type, 'searched by range')
+        rows = len(self)
+        key = _SortedColumn(self.dataset, dtype.names[column], rows)
+        start = bisect.bisect_left(key, low)
+        stop = rows if high is None else bisect.bisect_left(key, high, start)
+        return start, self.getColumns(columns, start, max(start, stop))
+
+    def getColumnStats(self):
+        """Get the row count and the min, max, sum, sum of squares, last
+        value and count of finite values of each column.
+
+        Returns (rows, mins, maxs, sums, sums_of_squares, lasts, counts),
+        each but the first an array with one entry per column.  NaNs are
+        left out of the min and max, and the sums and counts only cover
+        finite values, so sums / counts is the mean of those.  Columns
+        that are not real scalars have NaN min, max and last and a count
+        of 0.  Stats saved by older versions, without counts, are
+        recomputed.  The stats are updated as rows are
+        added and saved in the file when it is closed, so this does not
+        read the data.  Rows added before the stats were kept, such as
+        in older files, are read once in blocks to catch up.
+        """
+        if self._stats is None:
+            self._loadStats()
+        rows = len(self)
+        dtype = self.dataset.dtype
+        for pos in range(self._statsRows, rows, STATS_BLOCK_ROWS):
+            block = self.dataset[pos:min(pos + STATS_BLOCK_ROWS, rows)]
+            _update_stats(self._stats, _stats_values(block, dtype))
+            self._statsRows += len(block)
+            self._statsSaved = False
+        return _stats_result(self._statsRows, self._stats)
+
+    def _trim(self, fh):
+        """Drop preallocated rows beyond the logical end of the dataset.
+
+        'Row Count' is removed once the dataset is trimmed, so it only
+        exists while there is spare capacity.  A count left behind would
+        go stale if another program appended to the file, and hide its
+        rows the next time the file is opened.
+        """
+        f = fh()
+        rows, self._rows = self._rows, None
+        if 'DataVault' not in f:
+            return
+        dataset = f['DataVault']
+        if rows is None and ROW_COUNT_ATTR in f.attrs:
+            rows = min(int(f.attrs[ROW_COUNT_ATTR]), dataset.shape[0])
+        if rows is not None and dataset.shape[0] > rows:
+            dataset.resize((rows,))
+        if ROW_COUNT_ATTR in f.attrs:
+            del f.attrs[ROW_COUNT_ATTR]
+
+    def __len__(self):
+        if self._rows is None:
+            f = self.file
+            rows = f['DataVault'].shape[0]
+            if ROW_COUNT_ATTR in f.attrs:
+                rows = min(int(f.attrs[ROW_COUNT_ATTR]), rows)
+            self._rows = rows
+        return self._rows
+
+    def hasMore(self, pos):
+        return pos < len(self)
+
+    def rowCount(self):
+        return len(self)
+
+    def getDecimated(self, points, start, stop=None):
+        """Get at most points rows from [start, stop), evenly spaced.
+
+        Returns (step, columns), where every step-th row was taken and
+        columns holds one array per column.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        step = _bucket_rows(stop - start, points)
+        struct_data = self.dataset[start:stop:step]
+        columns = []
+        for idx in range(len(struct_data.dtype)):
+            col = struct_data['f{}'.format(idx)]
+            if col.dtype == object:
+                col = [_decode(x) for x in col]
+            columns.append(col)
+        return step, tuple(columns)
+
+    def getColumns(self, columns, start, stop=None, step=1):
+        """Get some columns of the rows in [start:stop:step].
 
-class ExtendedHDF5Data(HDF5MetaData):
+        Only the selected fields are read from the file.  Returns a tuple
+        with one array (or list, for string columns) per column.
+        """
+        dtype = self.dataset.dtype
+        for idx in columns:
+            if not 0 <= idx < len(dtype):
+                raise errors.NoSuchColumnError(idx, len(dtype))
+        if not columns:
+            return ()
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        names = sorted(set(dtype.names[idx] for idx in columns))
+        selection = (slice(start, stop, max(step, 1)),) + tuple(names)
+        struct_data = self.dataset[selection]
+        result = []
+        for idx in columns:
+            if len(names) > 1:
+                col = struct_data[dtype.names[idx]]
+            else:
+                col = struct_data
+            if dtype[idx] == object:
+                col = [_decode(x) for x in col]
+            result.append(col)
+        return tuple(result)
+
+    def getEnvelope(self, points, start, stop=None):
+        """Get the min, max and mean of each column over buckets of rows.
+
+        [start, stop) is split into at most points buckets of equal size.
+        The data is read in blocks of whole buckets, so the rows are never
+        all in memory at once.  Returns (bucket_rows, mins, maxs, means),
+        each of the last three a 2-D array with one row per bucket.
+        """
+        dtype = self.dataset.dtype
+        for idx in range(len(dtype)):
+            col_type = dtype[idx]
+            if col_type.shape or col_type.kind not in 'biuf':
+                raise errors.UnsupportedColumnError(idx, col_type, 'enveloped')
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        bucket_rows = _bucket_rows(stop - start, points)
+        block_rows = max(ENVELOPE_BLOCK_ROWS // bucket_rows, 1) * bucket_rows
+        parts = []
+        for pos in range(start, stop, block_rows):
+            block = self.dataset[pos:min(pos + block_rows, stop)]
+            data = np.column_stack([block[name].astype(np.float64)
+                                    for name in dtype.names])
+            parts.append(_envelope(data, bucket_rows))
+        if not parts:
+            empty = np.zeros((0, len(dtype)))
+            return bucket_rows, empty, empty, empty
+        mins, maxs, means = [np.concatenate(p) for p in zip(*parts)]
+        return bucket_rows, mins, maxs, means
+
+class ExtendedHDF5Data(HDF5Data):
     """Dataset backed by HDF5 file
 
     This supports the extended dataset format which allows each column
@@ -667,13 +1829,17 @@ class ExtendedHDF5Data(HDF5MetaData):
     """
 
     def __init__(self, fh):
-        self._file = fh
+        HDF5Data.__init__(self, fh)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([3, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], np.int32)
 
-    def initialize_info(self, title, indep, dep):
-        """Initialize the columns when creating a new dataset"""
+    def initialize_info(self, title, indep, dep, **storage):
+        """Initialize the columns when creating a new dataset
+
+        Keyword arguments set the chunk layout and compression of the
+        data, see HDF5Data._createDataset.
+        """
         dtype = []
         for idx, col in enumerate(indep + dep):
             shape = col.shape
@@ -701,23 +1867,12 @@ class ExtendedHDF5Data(HDF5MetaData):
             else:
                 raise RuntimeError("Invalid type tag {}".format(ttag))
 
-        self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+        self._createDataset(dtype, **storage)
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
     def addData(self, data):
         """Adds one or more rows or data from a numpy struct array."""
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
@@ -757,19 +1912,13 @@ class ExtendedHDF5Data(HDF5MetaData):
         return columns, new_pos
 
     def _getData(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
+        stop = len(self)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        struct_data = self.dataset[start:max(start, stop)]
         return struct_data, start + struct_data.shape[0]
 
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
-
-class SimpleHDF5Data(HDF5MetaData):
+class SimpleHDF5Data(HDF5Data):
     """Basic dataset backed by HDF5 file.
 
     This is a very simple implementation that only supports a single 2-D dataset
@@ -778,82 +1927,80 @@ class SimpleHDF5Data(HDF5MetaData):
     is stored in /DataVault within the HDF5 file.
     """
     def __init__(self, fh):
-        self._file = fh
+        HDF5Data.__init__(self, fh)
         if 'Version' not in self.file.attrs:
             self.file.attrs['Version'] = np.asarray([2, 0, 0], dtype=np.int32)
         self.version = np.asarray(self.file.attrs['Version'], dtype=np.int32)
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, **storage):
         ncol = len(indep) + len(dep)
         dtype = [('f{}'.format(idx), np.float64) for idx in range(ncol)]
         if 'DataVault' not in self.file:
-            self.file.create_dataset('DataVault', (0,), dtype=dtype, maxshape=(None,))
+            self._createDataset(dtype, **storage)
         HDF5MetaData.initialize_info(self, title, indep, dep)
 
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
     def addData(self, data):
         """Adds one or more rows or data from a 2D array of floats."""
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
         #if data.shape[1] != len(self.dataset.dtype):
         #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        #new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        #for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows:(old_rows + new_rows)] = data
+        self._appendRows(data)
 
     def getData(self, limit, start, transpose, simpleOnly):
         """Get up to limit rows from a dataset."""
         if transpose:
             raise RuntimeError("Transpose specified for simple data format: not supported")
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start:start+limit]
+        stop = len(self)
+        if limit is not None:
+            stop = min(stop, start + limit)
+        struct_data = self.dataset[start:max(start, stop)]
         columns = []
         for idx in range(len(struct_data.dtype)):
             columns.append(struct_data['f{}'.format(idx)])
         data = np.column_stack(columns)
         return data, start + data.shape[0]
 
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def hasMore(self, pos):
-        return pos < len(self)
+# HDF5 data objects in use, by file name.  The row count of an open file is
+# only kept in memory, so every user of a file must share one object.
+_hdf5_data = weakref.WeakValueDictionary()
+_hdf5_data_lock = threading.Lock() # files may be opened in worker threads
 
 def open_hdf5_file(filename):
     """Factory for HDF5 files.
 
     We check the version of the file to construct the proper class.  Currently, only two
     options exist: version 2.0.0 -> legacy format, 3.0.0 -> extended format.
-    Version 1 is reserved for CSV files.
+    Version 1 is reserved for CSV files.  A file that is already in use gets
+    the same object back.
     """
-    fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'))
-    version = fh().attrs['Version']
-    if version[0] == 2:
-        return SimpleHDF5Data(fh)
-    else:
-        return ExtendedHDF5Data(fh)
+    with _hdf5_data_lock:
+        data = _hdf5_data.get(os.path.abspath(filename))
+        if data is not None:
+            return data
+        fh = SelfClosingFile(h5py.File, open_args=(filename, 'a'), pool=file_pool)
+        version = fh().attrs['Version']
+        if version[0] == 2:
+            data = SimpleHDF5Data(fh)
+        else:
+            data = ExtendedHDF5Data(fh)
+        _hdf5_data[os.path.abspath(filename)] = data
+        return data
+
+def create_backend(filename, title, indep, dep, extended, **storage):
+    """Create a new HDF5 dataset.
 
-def create_backend(filename, title, indep, dep, extended):
+    Keyword arguments (chunk_rows, compression, shuffle) control the layout
+    of the data on disk.
+    """
+    parse_compression(storage.get('compression')) # fail before creating the file
     hdf5_file = filename + '.hdf5'
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'))
+    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, 'a'), pool=file_pool)
     if extended:
         data = ExtendedHDF5Data(fh)
     else:
         data = SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+    data.initialize_info(title, indep, dep, **storage)
+    with _hdf5_data_lock:
+        _hdf5_data[os.path.abspath(hdf5_file)] = data
     return data
 
 def open_backend(filename):
@@ -868,9 +2015,9 @@ def open_backend(filename):
 
     if os.path.exists(csv_file):
         if use_numpy:
-            return CsvNumpyData(csv_file)
+            return CsvNumpyData(csv_file, pool=file_pool)
         else:
-            return CsvListData(csv_file)
+            return CsvListData(csv_file, pool=file_pool)
     elif os.path.exists(hdf5_file):
         return open_hdf5_file(hdf5_file)
     else: # We should have already checked, this should not happen
@@ -46,3 +46,28 @@ class DataVersionMismatchError(T.Error):
     code = 11
     def __init__(self):
         self.msg = "Dataset was created with newer API, cannot be read.  Use get_ex"
+
+class BadStorageOptionError(T.Error):
+    code = 12
+    def __init__(self, name, value):
+        self.msg = "Invalid storage option {0}: {1!r}".format(name, value)
+
+class UnsupportedColumnError(T.Error):
+    code = 13
+    def __init__(self, index, datatype, action):
+        self.msg = "Column {0} of type {1} cannot be {2}.".format(index, datatype, action)
+
+class NoSuchColumnError(T.Error):
+    code = 14
+    def __init__(self, index, count):
+        self.msg = "No column {0}; dataset has {1} columns.".format(index, count)
+
+class NotAGridError(T.Error):
+    code = 15
+    def __init__(self, count):
+        self.msg = "A grid needs 2 independents; dataset has {0}.".format(count)
+
+class NoPointsError(T.Error):
+    code = 16
+    def __init__(self, points):
+        self.msg = "Cannot split rows into {0} points; need at least 1.".format(points)
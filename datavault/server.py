@@ -1,13 +1,15 @@
 
 
 import collections
+import weakref
 
 from twisted.internet.defer import inlineCallbacks
 import twisted.internet.task
 import numpy as np
 from labrad.server import LabradServer, Signal, setting
 
-from . import errors
+from . import backend, errors, util
+from . import Dataset, Session
 
 
 class DataVault(LabradServer):
@@ -27,11 +29,23 @@ class DataVault(LabradServer):
         self.onDataAvailable = Signal(543619, 'signal: data available', '')
         self.onNewParameter = Signal(543620, 'signal: new parameter', '')
         self.onCommentsAvailable = Signal(543621, 'signal: comments available', '')
+        self.onRowCount = Signal(543623, 'signal: row count', 'w')
+        self.onNewRows = Signal(543624, 'signal: new rows', '?')
 
     def initServer(self):
         # create root session
         _root = self.session_store.get([''])
 
+    def stopServer(self):
+        # write buffered rows and session info, and wait for I/O in worker
+        # threads, then trim preallocated rows and close any data files
+        Dataset.flush_all()
+        Session.flush_all()
+        d = self.session_store.executor.stop()
+        d.addCallback(lambda _: backend.file_pool.close_all())
+        d.addCallback(lambda _: backend.SelfClosingFile.close_all())
+        return d
+
     def contextKey(self, c):
         """The key used to identify a given context for notifications"""
         return c.ID
@@ -42,19 +56,27 @@ class DataVault(LabradServer):
         # start listening to the root session
         c['session'] = self.session_store.get([''])
         c['session'].listeners.add(self.contextKey(c))
+        # sessions and datasets this context may be listening to, so that
+        # expireContext only has to look at these
+        c['subscriptions'] = weakref.WeakSet([c['session']])
 
     def expireContext(self, c):
         """Stop sending any signals to this context."""
         key = self.contextKey(c)
-        def removeFromList(ls):
-            if key in ls:
-                ls.remove(key)
-        for session in self.session_store.get_all():
-            removeFromList(session.listeners)
-            for dataset in list(session.datasets.values()):
-                removeFromList(dataset.listeners)
-                removeFromList(dataset.param_listeners)
-                removeFromList(dataset.comment_listeners)
+        for obj in list(c.get('subscriptions', ())):
+            obj.listeners.discard(key)
+            getattr(obj, 'param_listeners', set()).discard(key)
+            getattr(obj, 'comment_listeners', set()).discard(key)
+            getattr(obj, 'row_streams', {}).pop(key, None)
+            getattr(obj, '_notify_pending', set()).discard(key)
+
+    def _setDataset(self, c, dataset):
+        """Make dataset the current dataset of context c."""
+        if 'datasetObj' in c:
+            c['datasetObj'].stopStreamingRows(self.contextKey(c))
+        c['dataset'] = dataset.name # not the same as name; has number prefixed
+        c['datasetObj'] = dataset
+        c['subscriptions'].add(dataset)
 
     def getSession(self, c):
         """Get a session object for the current path."""
@@ -123,6 +145,7 @@ class DataVault(LabradServer):
             c['session'].listeners.remove(key)
             session = self.session_store.get(temp)
             session.listeners.add(key)
+            c['subscriptions'].add(session)
             c['session'] = session
             c['path'] = temp
         return c['path']
@@ -162,8 +185,7 @@ class DataVault(LabradServer):
         """
         session = self.getSession(c)
         dataset = session.newDataset(name or 'untitled', independents, dependents)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
+        self._setDataset(c, dataset)
         c['filepos'] = 0 # start at the beginning
         c['commentpos'] = 0
         c['writing'] = True
@@ -172,8 +194,10 @@ class DataVault(LabradServer):
     @setting(1009, name='s', 
              independents='*(s*iss)',
              dependents='*(ss*iss)',
+             chunk_rows='w', compression='s', shuffle='b',
              returns=['*ss'])
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents,
+               chunk_rows=None, compression=None, shuffle=None):
         """Create a new extended dataset
 
         Independents are specified as: (label, shape, type, unit)
@@ -199,11 +223,24 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        The optional chunk_rows, compression and shuffle arguments override
+        the server defaults for how this dataset is laid out on disk.
+        chunk_rows is the number of rows per HDF5 chunk (0 for automatic),
+        compression is '', 'gzip', 'gzip:<level>' or 'lzf', and shuffle
+        enables the byte-shuffle filter.  See 'storage info'.
         """
+        storage = {}
+        if chunk_rows is not None:
+            storage['chunk_rows'] = chunk_rows
+        if compression is not None:
+            storage['compression'] = compression
+        if shuffle is not None:
+            storage['shuffle'] = shuffle
         session = self.getSession(c)
-        dataset = session.newDataset(name, independents, dependents, extended=True)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
+        dataset = session.newDataset(name, independents, dependents, extended=True,
+                                     storage=storage)
+        self._setDataset(c, dataset)
         c['filepos'] = 0 # start at the beginning
         c['commentpos'] = 0
         c['writing'] = True
@@ -217,9 +254,10 @@ class DataVault(LabradServer):
         Returns the path and name for this dataset.
         """
         session = self.getSession(c)
-        dataset = session.openDataset(name)
-        c['dataset'] = dataset.name # not the same as name; has number prefixed
-        c['datasetObj'] = dataset
+        return util.then(session.openDataset(name), self._openedDataset, c, append)
+
+    def _openedDataset(self, dataset, c, append):
+        self._setDataset(c, dataset)
         c['filepos'] = 0
         c['commentpos'] = 0
         c['writing'] = append
@@ -253,10 +291,7 @@ class DataVault(LabradServer):
         if not c['writing']:
             raise errors.ReadOnlyError()
         data = np.atleast_2d(np.asarray(data))
-        # fromarrays is faster than fromrecords, and when we have a simple 2-D array
-        # we can just transpose the array.
-        rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.addData(rec_data)
+        return dataset.addData(util.rows_to_record_array(data, dataset.data.dtype))
 
     @setting(1020, data='?', returns='')
     def add_ex(self, c, data):
@@ -272,8 +307,7 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        list_data = [tuple(row) for row in data]
-        dataset.addData(np.core.records.fromrecords(list_data, dtype=dataset.data.dtype))
+        return dataset.addData(util.rows_to_record_array(data, dataset.data.dtype))
 
     @setting(2020, data='?', returns='')
     def add_ex_t(self, c, data):
@@ -286,7 +320,55 @@ class DataVault(LabradServer):
         dataset = self.getDataset(c)
         if not c['writing']:
             raise errors.ReadOnlyError()
-        dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        return dataset.addData(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+
+    @setting(2026, 'add raw', columns='*(s{dtype}, *i{shape}, y{data})',
+             returns='')
+    def add_raw(self, c, columns):
+        """Add data to the current dataset as raw column buffers.
+
+        Each column is given as a numpy type string such as '<f8', the
+        shape of the column (rows first), and its bytes, as returned by
+        get raw.  This avoids flattening the data element by element, so
+        it is the fastest way to add large amounts of numeric data.
+        """
+        dataset = self.getDataset(c)
+        if not c['writing']:
+            raise errors.ReadOnlyError()
+        arrays = [util.from_raw(dtype, shape, data) for dtype, shape, data in columns]
+        return dataset.addData(np.core.records.fromarrays(arrays, dtype=dataset.data.dtype))
+
+    @setting(22, returns='')
+    def flush(self, c):
+        """Write any buffered rows of the current dataset to disk now.
+
+        Rows added with add, add_ex or add_ex_t may be held in memory for
+        a short time before being written, depending on the server's
+        flush_rows, flush_bytes and flush_delay options.
+        """
+        dataset = self.getDataset(c)
+        return dataset.flush()
+
+    @setting(23, 'stream rows', enable='b', step='w', returns='')
+    def stream_rows(self, c, enable=True, step=1):
+        """Push new rows of the current dataset to this context.
+
+        While enabled, rows are sent in 'signal: new rows' as soon as they
+        are written, starting from the current read position, so there is
+        no need to call get after each 'data available' signal.  Each
+        message is (w{first row}, ?{columns}), with the columns in the same
+        format as get_ex_t.  With step > 1 only every step-th row is sent.
+        Disabling moves the read position past the last row pushed, so get
+        continues from there.
+        """
+        dataset = self.getDataset(c)
+        key = self.contextKey(c)
+        if enable:
+            dataset.streamRows(key, c['filepos'], step)
+        else:
+            pos = dataset.stopStreamingRows(key)
+            if pos is not None:
+                c['filepos'] = pos
 
     @setting(21, limit='w', startOver='b', returns='*2v')
     def get(self, c, limit=None, startOver=False):
@@ -300,10 +382,8 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], simpleOnly=True)
-        key = self.contextKey(c)
-        dataset.keepStreaming(key, c['filepos'])
-        return data
+        result = dataset.getData(limit, c['filepos'], simpleOnly=True)
+        return util.then(result, self._gotData, c, dataset)
 
     @setting(1021, limit='w', startOver='b', returns='?')
     def get_ex(self, c, limit=None, startOver=False):
@@ -316,10 +396,8 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=False)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
-        return data
+        result = dataset.getData(limit, c['filepos'], transpose=False)
+        return util.then(result, self._gotData, c, dataset)
 
     @setting(2021, limit='w', startOver='b', returns='?')
     def get_ex_t(self, c, limit=None, startOver=False):
@@ -334,9 +412,159 @@ class DataVault(LabradServer):
         """
         dataset = self.getDataset(c)
         c['filepos'] = 0 if startOver else c['filepos']
-        data, c['filepos'] = dataset.getData(limit, c['filepos'], transpose=True)
-        ctx = self.contextKey(c)
-        dataset.keepStreaming(ctx, c['filepos'])
+        result = dataset.getData(limit, c['filepos'], transpose=True)
+        return util.then(result, self._gotData, c, dataset)
+
+    @setting(2024, 'get columns', columns='*w', start='w', stop='w', step='w',
+             returns='?')
+    def get_columns(self, c, columns, start=0, stop=None, step=1):
+        """Get selected columns of a range of rows of the current dataset.
+
+        Columns are given by index, counting independents then dependents.
+        Rows are taken from start up to stop (default: the end of the
+        dataset), every step-th row.  Only the selected columns are read
+        from disk.  Returns a cluster of columns, in the same format as
+        get_ex_t.  Does not change the position that get reads from.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getColumns(columns, start, stop, step)
+
+    @setting(2022, 'get decimated', points='w', start='w', stop='w',
+             returns='(w{step}, ?{columns})')
+    def get_decimated(self, c, points, start=0, stop=None):
+        """Get at most points evenly spaced rows of the current dataset.
+
+        Rows from start up to stop (default: the end of the dataset) are
+        decimated by taking every step-th row, with step chosen so that at
+        most points rows are returned; points must be at least 1.  Returns
+        the step and the columns, in the same format as get_ex_t.  Does not change the position that
+        get reads from.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getDecimated(points, start, stop)
+
+    @setting(2023, 'get envelope', points='w', start='w', stop='w',
+             returns='(w{bucket rows}, *2v{min}, *2v{max}, *2v{mean})')
+    def get_envelope(self, c, points, start=0, stop=None):
+        """Get the min, max and mean of each column over buckets of rows.
+
+        Rows from start up to stop (default: the end of the dataset) are
+        split into at most points buckets with the same number of rows;
+        points must be at least 1.  Returns the rows per bucket and three arrays, each with one row
+        per bucket and one column per dataset column.  Computed on the
+        server, reading a block of rows at a time, so plotting a long
+        dataset does not transfer every row.  Only works for datasets
+        whose columns are real scalars.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getEnvelope(points, start, stop)
+
+    @setting(2028, 'get where', column='w', low='v', high='v', columns='*w',
+             returns='(*i{rows}, ?{columns})')
+    def get_where(self, c, column, low, high, columns=None):
+        """Get the rows of the current dataset where a column is in a range.
+
+        Finds the rows where low <= column <= high, for a column of real
+        numbers, and returns their indices and the given columns of those
+        rows (default: all columns).  Only the parts of the dataset whose
+        values of the column overlap the range are read, using an index
+        of the min and max of each block of rows that is built the first
+        time a dataset is searched.  Does not change the read position.
+        """
+        dataset = self.getDataset(c)
+        if columns is None:
+            columns = list(range(len(dataset.data.dtype)))
+        return dataset.getWhere(column, low, high, columns)
+
+    @setting(2030, 'get grid', fast='w',
+             returns='(w{fast}, *v{fast values}, *v{slow values}, *3v{images})')
+    def get_grid(self, c, fast=None):
+        """Get a raster scan in the current dataset as one image per dependent.
+
+        The dataset must have two independents: a fast one that steps
+        through the same values on each line, and a slow one that is
+        constant along a line.  fast gives the index, 0 or 1, of the fast
+        independent; by default it is the one that changes first.
+        Returns the fast independent, its values along a line, the value
+        of the slow independent for each line, and an array of images
+        with one row per line and one image per dependent.  Points not
+        measured yet are NaN.  The server keeps the rows it has read, so
+        polling this during a scan only reads the new rows.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getGrid(fast)
+
+    @setting(2029, 'get time range', start='v', stop='v', columns='*w',
+             returns='(w{first row}, ?{columns})')
+    def get_time_range(self, c, start, stop=None, columns=None):
+        """Get the rows of the current dataset in a range of times.
+
+        The first independent must be a timestamp (or any real number)
+        that never decreases from one row to the next, as in a log.
+        Returns the index of the first row with start <= time < stop
+        (default: no upper limit) and the given columns (default: all
+        columns) of the matching rows.  The range is found by binary
+        search, so only the matching rows are read.  Does not change the
+        read position.
+        """
+        dataset = self.getDataset(c)
+        if columns is None:
+            columns = list(range(len(dataset.data.dtype)))
+        return dataset.getSortedRange(0, start, stop, columns)
+
+    @setting(2027, 'column stats',
+             returns='(w{rows}, *v{min}, *v{max}, *v{sum}, *v{sum of squares}, *v{last}, '
+                     '*i{count})')
+    def column_stats(self, c):
+        """Get running statistics for each column of the current dataset.
+
+        Returns the number of rows and, for each column, the minimum,
+        maximum, sum, sum of squares, last value and count of finite
+        values.  NaNs are ignored by the minimum and maximum, and the
+        sums only include the counted values, so sum / count is their
+        mean.  These are kept up to date as rows are added and stored
+        with the dataset, so this does not read the data.  Columns that
+        are not real scalars give a NaN minimum, maximum and last value
+        and a count of 0.
+        """
+        dataset = self.getDataset(c)
+        return dataset.getColumnStats()
+
+    @setting(2025, 'get raw', columns='*w', limit='w', startOver='b',
+             returns='*(s{dtype}, *i{shape}, y{data})')
+    def get_raw(self, c, columns=None, limit=None, startOver=False):
+        """Get data from the current dataset as raw column buffers.
+
+        Works like get_ex_t, reading from the current position, but only
+        for the given columns (default: all of them), and returns each
+        column as a numpy type string, its shape and its little-endian
+        bytes instead of a flattened array.  Use numpy.frombuffer to read
+        a column.  String columns cannot be read this way.
+        """
+        dataset = self.getDataset(c)
+        c['filepos'] = 0 if startOver else c['filepos']
+        dtype = dataset.data.dtype
+        if not columns:
+            columns = list(range(len(dtype)))
+        for idx in columns:
+            if not 0 <= idx < len(dtype):
+                raise errors.NoSuchColumnError(idx, len(dtype))
+            if dtype[idx] == object:
+                raise errors.UnsupportedColumnError(idx, 'str', 'sent as raw bytes')
+        stop = None if limit is None else c['filepos'] + limit
+        result = dataset.getColumns(columns, c['filepos'], stop)
+        return util.then(result, self._gotRaw, c, dataset)
+
+    def _gotRaw(self, result, c, dataset):
+        raw = [util.to_raw(column) for column in result]
+        rows = len(result[0]) if result else 0
+        self._gotData((None, c['filepos'] + rows), c, dataset)
+        return raw
+
+    def _gotData(self, result, c, dataset):
+        """Update the read position after a get and keep streaming."""
+        data, c['filepos'] = result
+        dataset.keepStreaming(self.contextKey(c), c['filepos'])
         return data
 
     @setting(100, returns='(*(ss){independents}, *(sss){dependents})')
@@ -386,6 +614,40 @@ class DataVault(LabradServer):
         ds = self.getDataset(c)
         return ds.getTransposeType()
 
+    @setting(104, 'storage info',
+             returns='(w{chunk rows}, s{compression}, b{shuffle}, '
+                     'v{stored bytes}, v{data bytes}, v{compression ratio})')
+    def storage_info(self, c):
+        """Report how the current dataset is stored on disk.
+
+        Returns the chunk size in rows, the compression filter, whether the
+        shuffle filter is on, the bytes allocated on disk, the uncompressed
+        size of the data, and the ratio of the two.  The byte counts are
+        real numbers, since a w cannot hold sizes of 4 GiB or more.  Useful
+        for tuning the chunk_rows and compression options of new_ex.
+        """
+        ds = self.getDataset(c)
+        chunk_rows, compression, shuffle, stored, size = ds.storageInfo()
+        ratio = float(size) / stored if stored else 1.0
+        return (chunk_rows, compression, bool(shuffle), float(stored),
+                float(size), ratio)
+
+    @setting(105, 'cache stats', returns='*(sw)')
+    def cache_stats(self, c):
+        """Get counters for the server's caches as (name, value) pairs.
+
+        Includes the number of data files open, the limit on open files, and
+        how many file accesses found the file open (hits), had to open it
+        (misses), or closed another file to make room (evictions).  Also
+        includes how many sessions and datasets are held in the caches,
+        how often they were found in memory or loaded, and how many were
+        dropped from the caches.
+        """
+        store = self.session_store
+        return (backend.file_pool.stats() +
+                store.session_cache.stats('session') +
+                store.dataset_cache.stats('dataset'))
+
     @setting(120, returns='*s')
     def parameters(self, c):
         """Get a list of parameter names."""
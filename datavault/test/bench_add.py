@@ -0,0 +1,59 @@
+"""Compare rows/s for converting rows to records and writing them in add
+and add_ex.
+
+Each timed step converts the rows and writes them to an HDF5 dataset held
+in memory, as add does, so a conversion that only makes a view still pays
+for the copy into the file.
+
+Run from the top directory with:
+
+    python -m datavault.test.bench_add [rows] [columns]
+"""
+
+import sys
+import timeit
+
+import h5py
+import numpy as np
+
+from datavault import util
+
+
+def old_add(data, dtype):
+    data = np.atleast_2d(np.asarray(data))
+    return np.core.records.fromarrays(data.T, dtype=dtype)
+
+
+def old_add_ex(data, dtype):
+    return np.core.records.fromrecords([tuple(row) for row in data], dtype=dtype)
+
+
+def rate(func, data, dtype, rows, dataset):
+    def add():
+        dataset[:rows] = func(data, dtype)
+    runs, total = timeit.Timer(add).autorange()
+    return rows * runs / total
+
+
+def main(rows=100000, cols=4):
+    dtype = np.dtype(','.join(['f8'] * cols))
+    f = h5py.File('bench_add.hdf5', 'w', driver='core', backing_store=False)
+    dataset = f.create_dataset('DataVault', (rows,), dtype=dtype)
+    array = np.random.rand(rows, cols)
+    clusters = [tuple(row) for row in array.tolist()]
+    cases = [
+        ('add', old_add, array),
+        ('add_ex', old_add_ex, array),
+        ('add_ex *()', old_add_ex, clusters),
+    ]
+    print('{} rows x {} columns'.format(rows, cols))
+    for name, old, data in cases:
+        before = rate(old, data, dtype, rows, dataset)
+        after = rate(util.rows_to_record_array, data, dtype, rows, dataset)
+        print('{:10} before {:14,.0f} rows/s  after {:14,.0f} rows/s  ({:.1f}x)'.format(
+              name, before, after, after / before))
+    f.close()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
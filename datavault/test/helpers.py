@@ -0,0 +1,19 @@
+"""Helpers shared by the datavault tests."""
+
+import queue
+
+from twisted.internet import task
+
+
+class ThreadedClock(task.Clock):
+    """Clock that queues calls from worker threads until pump() is called."""
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.from_thread = queue.Queue()
+
+    def callFromThread(self, f, *args, **kwargs):
+        self.from_thread.put((f, args, kwargs))
+
+    def pump(self):
+        f, args, kwargs = self.from_thread.get(timeout=5)
+        f(*args, **kwargs)
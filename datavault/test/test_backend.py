@@ -1,5 +1,6 @@
 import datetime
 import h5py
+import mock
 import numpy as np
 import os
 import pytest
@@ -12,9 +13,10 @@ import unittest
 from labrad import types as T
 from labrad import units as U
 
-from twisted.internet import task
+from twisted.internet import defer, task
 
 from datavault import backend, errors
+from datavault.test.helpers import ThreadedClock
 
 
 def _unique_filename(suffix='.hdf5'):
@@ -132,6 +134,126 @@ class SelfClosingFileTest(_TestCase):
         self.assertTrue(self.close_callback_called,
                     msg='Registered callback not called!')
 
+    def test_access_delays_timeout(self):
+        self.clock.advance(0.5)
+        self.file()
+        self.clock.advance(0.5)
+        self.assertTrue(self.opener.file.is_open,
+                    msg='File closed less than timeout after access')
+        self.clock.advance(0.5)
+        self.assertFalse(self.opener.file.is_open,
+                    msg='File not closed after timeout')
+
+    def test_pinned_file_stays_open(self):
+        self.file.pin()
+        self.clock.advance(3 * self.close_timeout_sec)
+        self.assertTrue(self.opener.file.is_open,
+                    msg='Pinned file was closed')
+        self.file.unpin()
+        self.clock.advance(self.close_timeout_sec)
+        self.clock.advance(self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open,
+                    msg='File not closed after unpin and timeout')
+
+
+class FilePoolTest(_TestCase):
+    """Tests for the FilePool shared by SelfClosingFiles."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FilePool(max_open=2, reactor=self.clock)
+        self.openers = [_MockFileOpener() for _ in range(3)]
+        self.files = [backend.SelfClosingFile(opener=opener,
+                                              timeout=1,
+                                              touch=False,
+                                              reactor=self.clock,
+                                              pool=self.pool)
+                      for opener in self.openers]
+
+    def test_evicts_least_recently_used(self):
+        self.files[0]()
+        self.files[1]()
+        self.files[0]()
+        self.files[2]()
+        self.assertTrue(self.openers[0].file.is_open)
+        self.assertFalse(self.openers[1].file.is_open,
+                         msg='Least recently used file not closed')
+        self.assertTrue(self.openers[2].file.is_open)
+        self.assertEqual(2, len(self.pool))
+        self.assertEqual(1, self.pool.evictions)
+
+    def test_pinned_file_not_evicted(self):
+        self.files[0].pin()
+        self.files[1]()
+        self.files[2]()
+        self.assertTrue(self.openers[0].file.is_open,
+                        msg='Pinned file was evicted')
+        self.assertFalse(self.openers[1].file.is_open)
+
+    def test_counts_hits_and_misses(self):
+        self.files[0]()
+        self.files[0]()
+        self.files[1]()
+        self.files[0]()
+        stats = dict(self.pool.stats())
+        self.assertEqual(2, stats['file hits'])
+        self.assertEqual(2, stats['file misses'])
+        self.assertEqual(2, stats['open files'])
+
+    def test_idle_files_closed_by_one_timer(self):
+        self.files[0]()
+        self.clock.advance(0.5)
+        self.files[1]()
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(0.5)
+        self.assertFalse(self.openers[0].file.is_open)
+        self.assertTrue(self.openers[1].file.is_open)
+        self.clock.advance(0.5)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertEqual(0, len(self.pool))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+class IOExecutorTest(_TestCase):
+    """Tests for the IOExecutor."""
+
+    def setUp(self):
+        self.clock = ThreadedClock()
+        self.executor = backend.IOExecutor(threads=2, reactor=self.clock)
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_submit_runs_in_worker(self):
+        results = []
+        d = self.executor.submit(
+                defer.DeferredLock(), lambda x: (x, backend.in_io_thread()), 1)
+        d.addCallback(results.append)
+        self.assertFalse(backend.in_io_thread())
+        self.clock.pump()
+        self.assertEqual([(1, True)], results)
+
+    def test_same_lock_runs_in_order(self):
+        lock = defer.DeferredLock()
+        calls = []
+        d1 = self.executor.submit(lock, calls.append, 'first')
+        d2 = self.executor.submit(lock, calls.append, 'second')
+        self.assertTrue(lock.locked)
+        self.clock.pump()
+        self.assertTrue(d1.called)
+        self.assertEqual(['first'], calls)
+        self.clock.pump()
+        self.assertTrue(d2.called)
+        self.assertEqual(['first', 'second'], calls)
+
+    def test_errors_fail_deferred(self):
+        failures = []
+        d = self.executor.submit(defer.DeferredLock(), int, 'x')
+        d.addErrback(failures.append)
+        self.clock.pump()
+        self.assertEqual(1, len(failures))
+        self.assertTrue(failures[0].check(ValueError))
+
 
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
@@ -401,25 +523,74 @@ c1=('2012-09-25, 03:14:15','fizz','buzz')
                 data.getTransposeType(), '(*v[Ghz],*v[Kelvin],*v[Dollars])')
 
 
-class _MockAttrs(dict):
-    """Mock Attributes class for use in the _MockDataset."""
-    def create(self, name, data, dtype):
-        self[name] = np.asarray(data, dtype=dtype)
-
-
-class _MockDataset(object):
-    """Mock Dataset class to use in the HDF5MetaDataTest."""
-    def __init__(self):
-        self.attrs = _MockAttrs()
-
-
 class HDF5MetaDataTest(_MetadataTest):
 
     def get_data(self):
+        # an HDF5 file that is only kept in memory
+        f = h5py.File(_unique_filename(), 'w', driver='core', backing_store=False)
+        self.addCleanup(f.close)
         data = backend.HDF5MetaData()
-        data.dataset = _MockDataset()
+        data.dataset = f.create_dataset('DataVault', (0,), dtype=np.float64)
         return data
 
+    def test_parameter_decoded_once(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        data.addParam('Param1', (1, 'a'))
+        with mock.patch.object(backend, 'labrad_urldecode',
+                               wraps=backend.labrad_urldecode) as decode:
+            self.assertEqual((1, 'a'), data.getParameter('Param1'))
+            self.assertEqual((1, 'a'), data.getParameter('param1', False))
+            self.assertEqual(1, decode.call_count)
+
+    def test_add_native_params(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        params = [('flag', True), ('count', 7), ('freq', 2.5),
+                  ('name', 'qubit'), ('trace', np.arange(4.0)),
+                  ('volts', U.Value(1.5, 'V')), ('pair', (1, 'a'))]
+        for name, value in params:
+            data.addParam(name, value, native=True)
+        attrs = data.dataset.attrs
+        self.assertEqual(7, attrs['Param.count'])
+        self.assertEqual('qubit', attrs['Param.name'])
+        self.assertTrue(attrs['Param.volts'].startswith(backend.DATA_URL_PREFIX))
+        self.assertTrue(attrs['Param.pair'].startswith(backend.DATA_URL_PREFIX))
+        data._paramValues = None # read back from the file
+        for name, value in params:
+            if isinstance(value, np.ndarray):
+                self.assertTrue(np.array_equal(value, data.getParameter(name)))
+            else:
+                self.assertEqual(value, data.getParameter(name))
+                self.assertEqual(type(value), type(data.getParameter(name)))
+
+    def test_column_info_read_once(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        row_type = data.getRowType()
+        del data.dataset.attrs['Independent0.label']
+        self.assertIs(row_type, data.getRowType())
+        self.assertEqual(data.getIndependents(), _INDEPENDENTS)
+        self.assertEqual(
+                data.getTransposeType(), '(*v[Ghz],*v[Kelvin],*v[Dollars])')
+
+    def test_comments_moved_from_attribute(self):
+        data = self.get_data()
+        data.initialize_info('FooTitle', _INDEPENDENTS, _DEPENDENTS)
+        old_comments = np.array([(1.0, 'old user', 'old comment')],
+                                dtype=data.comment_type)
+        data.dataset.attrs.create('Comments', old_comments,
+                                  dtype=data.comment_type)
+        self.assertEqual(data.numComments(), 1)
+        self.assertNotIn('Comments', data.dataset.parent)
+        data.addComment('new user', 'new comment')
+        self.assertEqual(data.numComments(), 2)
+        self.assertEqual(0, len(data.dataset.attrs['Comments']))
+        comments, next_pos = data.getComments(None, 0)
+        self.assertEqual(2, next_pos)
+        self.assertEqual(('old user', 'old comment'), comments[0][1:])
+        self.assertEqual(('new user', 'new comment'), comments[1][1:])
+
 
 class _BackendDataTestCase(_TestCase):
     def assert_data_in_backend(self, backend_data, expected_data):
@@ -581,6 +752,7 @@ class CsvNumpyDataTest(_BackendDataTest):
         for name in self.files_to_remove:
             _remove_file_if_exists(name)
             _remove_file_if_exists(name[:-4] + '.ini')
+            _remove_file_if_exists(name + backend.SIDECAR_SUFFIX)
 
 
     def get_backend_data(self, filename):
@@ -598,6 +770,238 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.assertRaises(
                errors.BadDataError, self.data.addData, [(1, 2, 3, 4)])
 
+    def test_add_many_rows_grows_buffer(self):
+        rows = np.arange(300.).reshape(100, 3)
+        for row in rows:
+            self.data.addData(np.core.records.fromarrays(row[:, np.newaxis]))
+        self.assertEqual(100, self.data.rowCount())
+        self.assertEqual(128, len(self.data._data))
+        self.assert_data_in_backend(self.data, rows)
+        # the file holds the same rows
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self.assert_arrays_equal(self.data.data, rows)
+
+class CsvReadTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.csv')
+        self.addCleanup(_remove_file_if_exists, self.filename)
+        self.addCleanup(_remove_file_if_exists,
+                        self.filename + backend.SIDECAR_SUFFIX)
+        self.clock = task.Clock()
+
+    def _write(self, text):
+        with open(self.filename, 'a', newline='') as f:
+            f.write(text)
+
+    def test_list_data_reads_only_new_lines(self):
+        self._write('1, 2\r\n3, 4\r\n5, ')
+        data = backend.CsvListData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assertEqual([[1, 2], [3, 4]], data.data)
+        self._write('6\r\n7, NAN\r\n')
+        with mock.patch.object(backend, '_parse_csv',
+                               wraps=backend._parse_csv) as parse:
+            rows = data.data
+        self.assertEqual([5, 6], rows[2])
+        self.assertEqual(4, len(rows))
+        self.assertTrue(np.isnan(rows[3][1]))
+        parse.assert_called_once_with('5, 6\n7, NAN\n')
+
+    def test_numpy_data_reads_in_blocks(self):
+        rows = np.arange(40.).reshape(20, 2) / 3
+        self._write(''.join('{!r},{!r}\r\n'.format(*row) for row in rows))
+        original_block_bytes = backend.CSV_BLOCK_BYTES
+        backend.CSV_BLOCK_BYTES = 50
+        self.addCleanup(setattr, backend, 'CSV_BLOCK_BYTES', original_block_bytes)
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, rows)
+
+    def test_numpy_data_uses_sidecar(self):
+        self._write('1,2\r\n3,4\r\n')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4]])
+        self.assertTrue(os.path.exists(self.filename + backend.SIDECAR_SUFFIX))
+        self.clock.advance(backend.DATA_TIMEOUT)
+        with mock.patch.object(backend, '_read_csv') as read_csv:
+            rows = data.data
+        read_csv.assert_not_called()
+        self.assertIsInstance(rows, np.memmap)
+        self.assert_arrays_equal(rows, [[1, 2], [3, 4]])
+        # appending copies out of the read-only map
+        data.cols = 2
+        data.addData(np.core.records.fromrecords([(5, 6)]))
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4], [5, 6]])
+
+    def test_stale_sidecar_is_ignored(self):
+        self._write('1,2\r\n')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, [[1, 2]])
+        self._write('3,4\r\n')
+        other = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(other.close)
+        self.assert_arrays_equal(other.data, [[1, 2], [3, 4]])
+        self.assertIsNone(backend._load_sidecar(self.filename + '.missing'))
+
+    def test_numpy_data_reads_only_new_lines_after_timeout(self):
+        self._write('1,2\r\n')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        data.cols = 2
+        data.addData(np.core.records.fromrecords([(3, 4)]))
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self._write('5,6\r\n')
+        with mock.patch.object(backend, '_parse_csv',
+                               wraps=backend._parse_csv) as parse:
+            rows = data.data
+        self.assert_arrays_equal(rows, [[1, 2], [3, 4], [5, 6]])
+        parse.assert_called_once_with('5,6\n')
+
+    def test_numpy_data_ignores_blank_lines_added_after_timeout(self):
+        self._write('1,2\r\n3,4\r\n')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4]])
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self._write('\r\n')
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4]])
+
+    def test_numpy_data_reads_last_line_without_newline(self):
+        self._write('1,2\r\n3,4\r\n5,6')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4], [5, 6]])
+
+    def test_sidecar_has_last_line_without_newline(self):
+        self._write('1,2\r\n3,4')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4]])
+        sidecar, size = backend._load_sidecar(self.filename)
+        self.assert_arrays_equal(sidecar, [[1, 2], [3, 4]])
+        self.assertEqual(os.path.getsize(self.filename), size)
+
+    def test_sidecar_not_saved_over_unread_lines(self):
+        self._write('1,2\r\n')
+        data = backend.CsvNumpyData(self.filename, reactor=self.clock)
+        self.addCleanup(data.close)
+        data.cols = 2
+        data.addData(np.core.records.fromrecords([(3, 4)]))
+        self._write('5,6\r\n') # not read before the data times out
+        self.clock.advance(backend.DATA_TIMEOUT)
+        self.assertEqual(1, len(backend._load_sidecar(self.filename, 5)[0]))
+        self.assert_arrays_equal(data.data, [[1, 2], [3, 4], [5, 6]])
+
+    def test_parse_falls_back_to_loadtxt(self):
+        parsed = backend._parse_csv('1,2\n\n3,4\n')
+        self.assert_arrays_equal(parsed, [[1, 2], [3, 4]])
+        self.assertRaises(ValueError, backend._parse_csv, '1,2\n3,x\n')
+        self.assertRaises(ValueError, backend._parse_csv, '1,2,3\n4,5\n6,7,8,9\n')
+        for text in ['1,2\n3,4x\n', '1,2\n3,4 5\n', '1,2\n3,4;5\n']:
+            self.assertRaises(ValueError, backend._parse_csv, text)
+
+
+class CsvEnvelopeTest(_TestCase):
+
+    def setUp(self):
+        self.filename = _unique_filename(suffix='.csv')
+        self.addCleanup(_remove_file_if_exists, self.filename)
+        self.addCleanup(_remove_file_if_exists,
+                        self.filename + backend.SIDECAR_SUFFIX)
+        with open(self.filename, 'w') as f:
+            for i in range(5):
+                f.write('{}, {}\r\n'.format(i, 2 * i))
+        self.data = backend.CsvNumpyData(self.filename, reactor=task.Clock())
+        self.data.cols = 2
+        self.addCleanup(self.data.close)
+
+    def test_get_decimated(self):
+        step, columns = self.data.getDecimated(3, 0)
+        self.assertEqual(2, step)
+        self.assert_arrays_equal(columns[1], [0, 4, 8])
+
+    def test_zero_points_rejected(self):
+        self.assertRaises(errors.NoPointsError, self.data.getDecimated, 0, 0)
+        self.assertRaises(errors.NoPointsError, self.data.getEnvelope, 0, 0)
+
+    def test_get_columns(self):
+        (column,) = self.data.getColumns([1], 1, None, 3)
+        self.assert_arrays_equal(column, [2, 8])
+        self.assertRaises(errors.NoSuchColumnError,
+                          self.data.getColumns, [2], 0)
+
+    def test_column_stats(self):
+        rows, mins, maxs, sums, _, lasts, counts = self.data.getColumnStats()
+        self.assertEqual(5, rows)
+        self.assert_arrays_equal(counts, [5, 5])
+        self.assert_arrays_equal(maxs, [4, 8])
+        self.assert_arrays_equal(sums, [10, 20])
+        self.assert_arrays_equal(lasts, [4, 8])
+
+    def test_get_where(self):
+        rows, (column,) = self.data.getWhere(1, 3, 6, [0])
+        self.assert_arrays_equal(rows, [2, 3])
+        self.assert_arrays_equal(column, [2, 3])
+
+    def test_get_sorted_range(self):
+        start, (column,) = self.data.getSortedRange(0, 1, 3, [1])
+        self.assertEqual(1, start)
+        self.assert_arrays_equal(column, [2, 4])
+
+    def test_get_envelope(self):
+        bucket_rows, mins, maxs, means = self.data.getEnvelope(2, 1)
+        self.assertEqual(2, bucket_rows)
+        self.assert_arrays_equal(mins, [[1, 2], [3, 6]])
+        self.assert_arrays_equal(maxs, [[2, 4], [4, 8]])
+        self.assert_arrays_equal(means, [[1.5, 3], [3.5, 7]])
+
+
+class GridTest(_TestCase):
+
+    def _scan(self, fast_first=True):
+        """Rows of a 3 x 2 scan, y slow and x fast, with z = 10 * y + x."""
+        y, x = np.mgrid[0:2, 0:3]
+        x, y = x.ravel(), y.ravel()
+        indeps = [x, y] if fast_first else [y, x]
+        return indeps + [10. * y + x]
+
+    def test_detects_fast_axis(self):
+        for fast_first, fast in [(True, 0), (False, 1)]:
+            grid = backend.Grid()
+            grid.add(0, self._scan(fast_first))
+            fast_idx, fast_values, slow_values, images = grid.get()
+            self.assertEqual(fast, fast_idx)
+            self.assert_arrays_equal(fast_values, [0, 1, 2])
+            self.assert_arrays_equal(slow_values, [0, 1])
+            self.assert_arrays_equal(images, [[[0, 1, 2], [10, 11, 12]]])
+
+    def test_incremental_rows(self):
+        grid = backend.Grid()
+        scan = self._scan()
+        grid.add(0, [col[:2] for col in scan])
+        _, fast_values, _, images = grid.get()
+        self.assert_arrays_equal(fast_values, [0, 1])
+        self.assert_arrays_equal(images, [[[0, 1]]])
+        grid.add(2, [col[2:4] for col in scan])
+        # rows that were already added are skipped
+        grid.add(3, [col[3:5] for col in scan])
+        _, fast_values, slow_values, images = grid.get()
+        self.assertEqual(5, grid.rows)
+        self.assert_arrays_equal(fast_values, [0, 1, 2])
+        self.assert_arrays_equal(slow_values, [0, 1])
+        self.assertTrue(np.isnan(images[0, 1, 2]))
+        self.assert_arrays_equal(images[0, :, :2], [[0, 1], [10, 11]])
+
+    def test_empty(self):
+        grid = backend.Grid()
+        grid.add(0, [np.zeros(0)] * 3)
+        _, fast_values, slow_values, images = grid.get()
+        self.assertEqual((1, 0, 0), images.shape)
+
+
 class ExtendedHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -635,6 +1039,219 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         self.assertEqual(len(actual), 3)
         self.assert_arrays_equal(actual, [[1, 4], [2, 5], [3, 6]])
 
+    def _add_ramp(self, rows, data=None):
+        data_to_add = np.recarray(
+            (rows, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add['f0'] = np.arange(rows)
+        data_to_add['f1'] = -np.arange(rows)
+        data_to_add['f2'] = 1.0
+        if data is None:
+            data = self.data
+        data.addData(data_to_add)
+
+    def test_get_decimated(self):
+        self._add_ramp(10)
+        step, columns = self.data.getDecimated(4, 0)
+        self.assertEqual(3, step)
+        self.assert_arrays_equal(columns[0], [0, 3, 6, 9])
+        self.assert_arrays_equal(columns[1], [0, -3, -6, -9])
+        step, columns = self.data.getDecimated(100, 2, 5)
+        self.assertEqual(1, step)
+        self.assert_arrays_equal(columns[0], [2, 3, 4])
+
+    def test_get_envelope_in_blocks(self):
+        self._add_ramp(10)
+        original_block_rows = backend.ENVELOPE_BLOCK_ROWS
+        backend.ENVELOPE_BLOCK_ROWS = 4 # read 4 rows, two buckets, at a time
+        self.addCleanup(setattr, backend, 'ENVELOPE_BLOCK_ROWS',
+                        original_block_rows)
+        bucket_rows, mins, maxs, means = self.data.getEnvelope(5, 0)
+        self.assertEqual(2, bucket_rows)
+        self.assert_arrays_equal(mins[:, 0], [0, 2, 4, 6, 8])
+        self.assert_arrays_equal(maxs[:, 0], [1, 3, 5, 7, 9])
+        self.assert_arrays_equal(mins[:, 1], [-1, -3, -5, -7, -9])
+        self.assert_arrays_equal(means[:, 0], [0.5, 2.5, 4.5, 6.5, 8.5])
+        self.assert_arrays_equal(means[:, 2], [1, 1, 1, 1, 1])
+        bucket_rows, mins, maxs, means = self.data.getEnvelope(2, 5)
+        self.assertEqual(3, bucket_rows)
+        self.assert_arrays_equal(maxs[:, 0], [7, 9])
+        self.assert_arrays_equal(means[:, 0], [6, 8.5])
+
+    def test_get_envelope_empty(self):
+        bucket_rows, mins, maxs, means = self.data.getEnvelope(5, 0)
+        self.assertEqual((0, 3), mins.shape)
+
+    def test_zero_points_rejected(self):
+        self._add_ramp(10)
+        self.assertRaises(errors.NoPointsError, self.data.getDecimated, 0, 0)
+        self.assertRaises(errors.NoPointsError, self.data.getEnvelope, 0, 0)
+
+    def test_get_columns(self):
+        self._add_ramp(6)
+        columns = self.data.getColumns([2, 0], 1, 6, 2)
+        self.assertEqual(2, len(columns))
+        self.assert_arrays_equal(columns[0], [1, 1, 1])
+        self.assert_arrays_equal(columns[1], [1, 3, 5])
+        (column,) = self.data.getColumns([1], 4)
+        self.assert_arrays_equal(column, [-4, -5])
+        self.assertRaises(errors.NoSuchColumnError,
+                          self.data.getColumns, [3], 0)
+
+    def test_column_stats(self):
+        self._add_ramp(3)
+        self._add_ramp(2)
+        rows, mins, maxs, sums, sumsqs, lasts, counts = self.data.getColumnStats()
+        self.assertEqual(5, rows)
+        self.assert_arrays_equal(mins, [0, -2, 1])
+        self.assert_arrays_equal(maxs, [2, 0, 1])
+        self.assert_arrays_equal(sums, [4, -4, 5])
+        self.assert_arrays_equal(sumsqs, [6, 6, 5])
+        self.assert_arrays_equal(lasts, [1, -1, 1])
+        self.assert_arrays_equal(counts, [5, 5, 5])
+
+    def test_column_stats_skip_nan(self):
+        self._add_ramp(3)
+        rows = self.data.dataset[:2].copy()
+        rows['f1'] = [np.nan, np.inf]
+        self.data.addData(rows)
+        _, mins, maxs, sums, sumsqs, lasts, counts = self.data.getColumnStats()
+        self.assert_arrays_equal(mins[:2], [0, -2])
+        self.assert_arrays_equal(maxs[:2], [2, np.inf])
+        self.assert_arrays_equal(sums[:2], [4, -3])
+        self.assert_arrays_equal(sumsqs[:2], [6, 5])
+        self.assert_arrays_equal(counts, [5, 3, 5])
+        self.assertEqual(np.inf, lasts[1])
+
+    def test_column_stats_saved_on_close(self):
+        self._add_ramp(4)
+        self.data.close()
+        reopened = self.get_backend_data(self.filename)
+        attrs = reopened.file.attrs
+        self.assertEqual(4, attrs[backend.STATS_ROWS_ATTR])
+        self.assert_arrays_equal(attrs[backend.STATS_ATTR][2], [6, -6, 4])
+        with mock.patch.object(backend, '_stats_values') as stats_values:
+            rows, _, maxs, _, _, _, _ = reopened.getColumnStats()
+        self.assertEqual(4, rows)
+        self.assert_arrays_equal(maxs, [3, 0, 1])
+        stats_values.assert_not_called()
+
+    def test_column_stats_without_counts_recomputed(self):
+        self._add_ramp(4)
+        self.data.close()
+        f = self.data.file
+        f.attrs[backend.STATS_ATTR] = np.zeros((5, 3))
+        self.data.close()
+        reopened = self.get_backend_data(self.filename)
+        rows, _, maxs, _, _, _, counts = reopened.getColumnStats()
+        self.assertEqual(4, rows)
+        self.assert_arrays_equal(maxs, [3, 0, 1])
+        self.assert_arrays_equal(counts, [4, 4, 4])
+
+    def test_column_stats_catch_up_in_blocks(self):
+        self._add_ramp(5)
+        self.data.close()
+        f = self.data.file
+        del f.attrs[backend.STATS_ATTR]
+        del f.attrs[backend.STATS_ROWS_ATTR]
+        self.data.close()
+        original_block_rows = backend.STATS_BLOCK_ROWS
+        backend.STATS_BLOCK_ROWS = 2
+        self.addCleanup(setattr, backend, 'STATS_BLOCK_ROWS',
+                        original_block_rows)
+        old = self.get_backend_data(self.filename)
+        self._add_ramp(1, old) # not counted yet: earlier rows have no stats
+        rows, mins, _, sums, _, lasts, _ = old.getColumnStats()
+        self.assertEqual(6, rows)
+        self.assert_arrays_equal(mins, [0, -4, 1])
+        self.assert_arrays_equal(sums, [10, -10, 6])
+        self.assert_arrays_equal(lasts, [0, 0, 1])
+
+    def test_get_where_reads_matching_zones(self):
+        self._add_ramp(10)
+        original_zone_rows = backend.ZONE_ROWS
+        backend.ZONE_ROWS = 4
+        self.addCleanup(setattr, backend, 'ZONE_ROWS', original_zone_rows)
+        with mock.patch.object(self.data, 'getColumns',
+                               wraps=self.data.getColumns) as get_columns:
+            rows, (col,) = self.data.getWhere(0, 5, 8.5, [1])
+        self.assert_arrays_equal(rows, [5, 6, 7, 8])
+        self.assert_arrays_equal(col, [-5, -6, -7, -8])
+        get_columns.assert_called_once_with([0, 1], 4, 10)
+        # rows added later are indexed as they are written
+        self._add_ramp(3)
+        rows, (col,) = self.data.getWhere(1, -1, 0, [0])
+        self.assert_arrays_equal(rows, [0, 1, 10, 11])
+        self.assert_arrays_equal(col, [0, 1, 0, 1])
+        rows, columns = self.data.getWhere(0, 20, 30, [0, 2])
+        self.assertEqual(0, len(rows))
+        self.assertEqual([0, 0], [len(col) for col in columns])
+        self.assertRaises(errors.NoSuchColumnError,
+                          self.data.getWhere, 3, 0, 1, [0])
+
+    def test_zone_map_saved_on_close(self):
+        self._add_ramp(10)
+        original_zone_rows = backend.ZONE_ROWS
+        backend.ZONE_ROWS = 4
+        self.addCleanup(setattr, backend, 'ZONE_ROWS', original_zone_rows)
+        self.data.getWhere(0, 0, 1, [])
+        self._add_ramp(3)
+        self.data.close()
+        zone_map = self.data.file[backend.ZONE_MAP_NAME]
+        self.assertEqual(13, zone_map.attrs['Indexed Rows'])
+        self.assertEqual(4, zone_map.attrs['Zone Rows'])
+        self.assert_arrays_equal(zone_map[:, 0, 0], [0, 4, 0, 2])
+        self.assert_arrays_equal(zone_map[:, 1, 0], [3, 7, 9, 2])
+
+    def test_get_sorted_range(self):
+        self._add_ramp(100)
+        with mock.patch.object(backend._SortedColumn, '__getitem__',
+                               autospec=True,
+                               side_effect=backend._SortedColumn.__getitem__) as get:
+            start, (x, y) = self.data.getSortedRange(0, 40.5, 43, [0, 1])
+        self.assertEqual(41, start)
+        self.assert_arrays_equal(x, [41, 42])
+        self.assert_arrays_equal(y, [-41, -42])
+        self.assertLess(get.call_count, 20)
+        start, (x,) = self.data.getSortedRange(0, 98, None, [0])
+        self.assertEqual(98, start)
+        self.assert_arrays_equal(x, [98, 99])
+        start, (x,) = self.data.getSortedRange(0, 200, 300, [0])
+        self.assertEqual(100, start)
+        self.assertEqual(0, len(x))
+
+    def test_sorted_column_reads_one_field(self):
+        self._add_ramp(10)
+        dataset = mock.MagicMock(wraps=self.data.dataset)
+        dataset.__getitem__.side_effect = self.data.dataset.__getitem__
+        key = backend._SortedColumn(dataset, 'f1', 10)
+        self.assertEqual(-3, key[3])
+        dataset.__getitem__.assert_called_once_with((3, 'f1'))
+
+    def test_get_array_column(self):
+        filename = _unique_filename(suffix='.hdf5')
+        data = self.get_backend_data(filename)
+        data.initialize_info('FooTitle', [
+                backend.Independent(label='Trace', shape=(2,),
+                                    datatype='v', unit='V'),
+                backend.Independent(label='Index', shape=(1,),
+                                    datatype='i', unit='')], [])
+        rows = np.recarray((3,), dtype=data.dtype)
+        rows['f0'] = [[0, 1], [2, 3], [4, 5]]
+        rows['f1'] = [7, 8, 9]
+        data.addData(rows)
+        (trace,) = data.getColumns([0], 1)
+        self.assert_arrays_equal(trace, [[2, 3], [4, 5]])
+
+    def test_get_envelope_unsupported_column(self):
+        filename = _unique_filename(suffix='.hdf5')
+        data = self.get_backend_data(filename)
+        data.initialize_info('FooTitle', [
+                backend.Independent(label='Trace', shape=(2,),
+                                    datatype='v', unit='V')], [])
+        self.assertRaises(errors.UnsupportedColumnError,
+                          data.getEnvelope, 5, 0)
+
     def test_initialize_info_bad_vars(self):
         bad_independents = [
                         backend.Independent(
@@ -786,6 +1403,92 @@ class ExtendedHDF5DataTest(_BackendDataTest):
                 [])
 
 
+    def test_add_rows_preallocates(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        for i in range(5):
+            row[0] = (i, i, i)
+            self.data.addData(row)
+        self.assertEqual(len(self.data), 5)
+        self.assertEqual(
+                self.data.dataset.shape[0], backend.MIN_CAPACITY_ROWS)
+        self.assertTrue(self.data.hasMore(4))
+        self.assertFalse(self.data.hasMore(5))
+        read_data, next_pos = self.data.getData(None, 3, True, None)
+        self.assertEqual(next_pos, 5)
+        self.assert_arrays_equal(read_data[0], [3, 4])
+
+    def test_trim_on_close(self):
+        data_to_add = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        data_to_add[1] = (4, 5, 6)
+        self.data.addData(data_to_add)
+        self.data._file.close()
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['DataVault'].shape, (2,))
+            self.assertNotIn('Row Count', f.attrs)
+
+    def test_rows_appended_by_other_programs_are_kept(self):
+        data_to_add = np.recarray(
+            (2, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        data_to_add[1] = (4, 5, 6)
+        self.data.addData(data_to_add)
+        self.data._file.close()
+        with h5py.File(self.filename, 'a') as f:
+            f['DataVault'].resize((3,))
+            f['DataVault'][2] = (7, 8, 9)
+        self.assertEqual(3, len(self.data))
+        self.data._file.close()
+        with h5py.File(self.filename, 'r') as f:
+            self.assertEqual(f['DataVault'].shape, (3,))
+
+    def test_row_count_written_when_capacity_grows(self):
+        row = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        self.data.addData(row)
+        self.data.addData(row)
+        self.assertEqual(1, self.data.file.attrs['Row Count'])
+        self.assertEqual(2, len(self.data))
+
+
+    def test_initialize_chunks_and_compression(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        data.initialize_info('Foo', _INDEPENDENTS, _DEPENDENTS,
+                             chunk_rows=128, compression='gzip:4',
+                             shuffle=True)
+        self.assertEqual(data.dataset.chunks, (128,))
+        self.assertEqual(data.dataset.compression, 'gzip')
+        self.assertEqual(data.dataset.compression_opts, 4)
+        self.assertTrue(data.dataset.shuffle)
+        rows = np.recarray((1000, ), dtype=data.dtype)
+        rows['f0'] = np.arange(1000)
+        rows['f1'] = 0
+        rows['f2'] = 1
+        data.addData(rows)
+        chunk_rows, compression, shuffle, stored, size = data.storageInfo()
+        self.assertEqual(chunk_rows, 128)
+        self.assertEqual(compression, 'gzip:4')
+        self.assertEqual(size, 1000 * 24)
+        self.assertLess(stored, size)
+
+    def test_initialize_bad_compression(self):
+        name = _unique_filename()
+        data = self.get_backend_data(name)
+        for spec in ['zip', 'gzip:x', 'gzip:10', 'lzf:1']:
+            self.assertRaises(
+                    errors.BadStorageOptionError,
+                    data.initialize_info,
+                    'Foo', _INDEPENDENTS, _DEPENDENTS,
+                    compression=spec)
+
+
 class SimpleHDF5DataTest(_BackendDataTest):
 
     def setUp(self):
@@ -811,5 +1514,16 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.dtype, np.dtype(float))
         self.assertEqual(read_data.size, 0)
 
+    def test_read_ignores_preallocated_rows(self):
+        data_to_add = np.recarray(
+            (1, ),
+            dtype=[('f0', '<f8'), ('f1', '<f8'), ('f2', '<f8')])
+        data_to_add[0] = (1, 2, 3)
+        self.data.addData(data_to_add)
+        self.assertGreater(self.data.dataset.shape[0], 1)
+        read_data, next_pos = self.data.getData(None, 0, False, None)
+        self.assertEqual(next_pos, 1)
+        self.assert_arrays_equal(read_data, [[1, 2, 3]])
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
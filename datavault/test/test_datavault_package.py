@@ -1,3 +1,4 @@
+import gc
 import mock
 import numpy as np
 import os
@@ -9,7 +10,9 @@ from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+from datavault import backend
+from datavault import Session, Dataset, SessionStore, DEFAULT_OPTIONS
+from datavault.test.helpers import ThreadedClock
 
 
 def _unique_dir():
@@ -66,6 +69,34 @@ class TestSessionStore(unittest.TestCase):
         bar_session = store.get('bar')
         self.assertEqual([foo_session, bar_session], store.get_all())
 
+    def test_recent_sessions_stay_cached(self):
+        store = SessionStore(self.datadir, self.hub,
+                             {'session_cache_size': 8})
+        session_id = id(store.get(['', 'foo']))
+        self.assertEqual(session_id, id(store.get(['', 'foo'])))
+        self.assertEqual(1, store.session_cache.hits)
+
+    def test_cached_dataset_found_through_new_session(self):
+        store = SessionStore(self.datadir, self.hub)
+        session = store.get(['', 'foo'])
+        dataset = session.newDataset('Foo', [('x', 'V')], [('y', '', 'V')])
+        dataset_id = id(dataset)
+        del session, dataset
+        gc.collect()
+        self.assertEqual([], store.get_all())
+        session = store.get(['', 'foo'])
+        self.assertEqual(dataset_id, id(session.openDataset('00001 - Foo')))
+        self.assertEqual(dataset_id, id(session.openDataset('00001 - Foo')))
+        self.assertEqual(2, store.dataset_cache.hits)
+        self.assertEqual(0, store.dataset_cache.misses)
+
+    def test_session_cache_size(self):
+        store = SessionStore(self.datadir, self.hub,
+                             {'session_cache_size': 1})
+        store.get(['', 'foo'])
+        store.get(['', 'bar'])
+        self.assertEqual([('', 'bar')], [s.path for s in store.get_all()])
+
 
 class _DatavaultTestCase(unittest.TestCase):
     _TITLE = 'Foo'
@@ -152,6 +183,60 @@ class SessionTest(_DatavaultTestCase):
         child_session = self._get_session(path=['parent', 'child'])
         self.hub.onNewDir.assert_called_with('child', set(['foo_listener']))
 
+    def test_threaded_opens_of_one_file_run_in_turn(self):
+        clock = ThreadedClock()
+        executor = backend.IOExecutor(threads=2, reactor=clock)
+        self.addCleanup(executor.stop)
+        session = Session(self.datadir, ['foo'], self.hub, self.store,
+                          executor=executor, reactor=clock)
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        gc.collect()
+        self.assertEqual(0, len(session.datasets))
+        opened = []
+        session.openDataset('00001 - Foo').addCallback(opened.append)
+        session.openDataset('00001 - Foo').addCallback(opened.append)
+        lock = session._open_locks['00001 - Foo']
+        self.assertEqual(1, len(lock.waiting))
+        clock.pump()
+        clock.pump()
+        self.assertEqual(2, len(opened))
+        self.assertIs(opened[0], opened[1])
+        self.assertEqual({}, session._open_locks)
+
+    def test_access_saves_after_delay(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store,
+                          reactor=clock)
+        saved = os.path.getmtime(session.infofile)
+        os.utime(session.infofile, (saved - 10, saved - 10))
+        session.access()
+        session.access()
+        self.assertEqual(saved - 10, os.path.getmtime(session.infofile))
+        self.assertEqual(1, len(clock.getDelayedCalls()))
+        clock.advance(DEFAULT_OPTIONS['session_save_delay'])
+        self.assertGreater(os.path.getmtime(session.infofile), saved - 10)
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_new_dataset_saves_counter(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store,
+                          reactor=clock)
+        session.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        reloaded = Session(self.datadir, ['foo'], self.hub, self.store,
+                           reactor=clock)
+        self.assertEqual(2, reloaded.counter)
+
+    def test_flush_all_saves_sessions(self):
+        clock = task.Clock()
+        session = Session(self.datadir, ['foo'], self.hub, self.store,
+                          reactor=clock)
+        saved = os.path.getmtime(session.infofile)
+        os.utime(session.infofile, (saved - 10, saved - 10))
+        session.access()
+        Session.flush_all()
+        self.assertGreater(os.path.getmtime(session.infofile), saved - 10)
+        self.assertEqual([], clock.getDelayedCalls())
+
     def test_save_reload_dataset(self):
         s1 = self._get_session()
         d1 = s1.newDataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
@@ -521,6 +606,221 @@ class DatasetTest(_DatavaultTestCase):
         # Trigger the listener again.
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def _get_buffered_dataset(self, clock, **options):
+        buffer_options = dict(DEFAULT_OPTIONS)
+        buffer_options.update(options)
+        return Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                options=buffer_options,
+                reactor=clock)
+
+    def _reopen_dataset(self, dataset, clock, **options):
+        reopen_options = dict(DEFAULT_OPTIONS)
+        reopen_options.update(options)
+        return Dataset(
+                self.session,
+                dataset.name,
+                options=reopen_options,
+                reactor=clock,
+                data=dataset.data)
+
+    def test_open_writes_access_time_later(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock)
+        attrs = dataset.data.dataset.attrs
+        attrs['Access Time'] = 0.0
+        reopened = self._reopen_dataset(dataset, clock)
+        self.assertEqual(0.0, attrs['Access Time'])
+        clock.advance(DEFAULT_OPTIONS['access_time_delay'])
+        self.assertGreater(attrs['Access Time'], 0.0)
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_open_without_access_tracking(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock)
+        reopened = self._reopen_dataset(dataset, clock,
+                                        track_access_time=False)
+        self.assertEqual([], clock.getDelayedCalls())
+        self.assertNotIn(reopened, Dataset._unsaved_access)
+
+    def test_flush_all_writes_access_time(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock)
+        reopened = self._reopen_dataset(dataset, clock)
+        reopened.accessed = 12345.0
+        Dataset.flush_all()
+        self.assertEqual(12345.0, dataset.data.dataset.attrs['Access Time'])
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_buffered_add_flushes_on_row_count(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock, flush_rows=3)
+        dataset.listeners.add('listener')
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+
+        dataset.addData(data)
+        dataset.addData(data)
+        self.assertFalse(self.hub.onDataAvailable.called)
+        self.assertEqual(0, len(dataset.data))
+        self.assertTrue(dataset.hasMore(0))
+
+        dataset.addData(data)
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['listener']))
+        self.assertEqual(3, len(dataset.data))
+        self.assertFalse(clock.getDelayedCalls())
+
+    def test_buffered_add_flushes_on_timer(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(
+                clock, flush_rows=100, flush_delay=0.5)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        self.assertEqual(0, len(dataset.data))
+        clock.advance(0.5)
+        self.assertEqual(1, len(dataset.data))
+
+    def test_buffered_add_flushes_on_bytes(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(
+                clock, flush_rows=100, flush_bytes=48)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        dataset.addData(data)
+        self.assertEqual(0, len(dataset.data))
+        dataset.addData(data)
+        self.assertEqual(2, len(dataset.data))
+
+    def test_buffered_rows_are_read(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock, flush_rows=100)
+        data = self._get_records_simple(
+                [(1, 2, 3), (4, 5, 6)], dataset.data.dtype)
+        dataset.addData(data)
+        data_in_dataset, count = dataset.getData(None, 0, simpleOnly=True)
+        self.assertEqual(2, count)
+        self.assertArrayEqual([[1, 2, 3], [4, 5, 6]], data_in_dataset)
+        self.assertFalse(clock.getDelayedCalls())
+
+    def test_failed_add_writes_nothing(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        with mock.patch.object(dataset.data, 'addData', side_effect=IOError('disk')):
+            self.assertRaises(IOError, dataset.addData, data)
+        self.assertEqual(0, dataset.rowCount())
+        # the client retries; the failed rows are not written again
+        dataset.addData(data)
+        rows, count = dataset.getData(None, 0, simpleOnly=True)
+        self.assertEqual(1, count)
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_failed_buffered_write_is_retried(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(
+                clock, flush_rows=1, flush_delay=0.5, write_retries=1)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        add_data = dataset.data.addData
+        failures = [IOError('disk')]
+        def fail_once(rows):
+            if failures:
+                raise failures.pop()
+            return add_data(rows)
+        with mock.patch.object(dataset.data, 'addData', side_effect=fail_once):
+            dataset.addData(data) # already accepted, so no error
+            self.assertEqual(0, len(dataset.data))
+            self.assertEqual(1, dataset.rowCount())
+            clock.advance(0.5)
+        self.assertEqual(1, len(dataset.data))
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_failed_buffered_write_does_not_fail_readers(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(
+                clock, flush_rows=1, write_retries=1)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+        with mock.patch.object(dataset.data, 'addData', side_effect=IOError('disk')):
+            dataset.addData(data)
+            # readers get the rows already written instead of the error
+            rows, count = dataset.getData(None, 0, simpleOnly=True)
+            self.assertEqual(0, count)
+        # the write was retried once, then the rows were dropped
+        self.assertEqual(0, dataset.rowCount())
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_grid_dropped_after_data_timeout(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock)
+        data = self._get_records_simple(
+                [(0, 0, 1), (1, 0, 2), (0, 1, 3), (1, 1, 4)], dataset.data.dtype)
+        dataset.addData(data)
+        _, _, _, images = dataset.getGrid()
+        self.assertArrayEqual([[[1, 2], [3, 4]]], images)
+        clock.advance(backend.DATA_TIMEOUT - 1)
+        dataset.getGrid() # using the grid keeps it
+        clock.advance(backend.DATA_TIMEOUT - 1)
+        self.assertIsNotNone(dataset._grid)
+        clock.advance(1)
+        self.assertIsNone(dataset._grid)
+        self.assertEqual([], clock.getDelayedCalls())
+        _, _, _, images = dataset.getGrid()
+        self.assertArrayEqual([[[1, 2], [3, 4]]], images)
+
+    def test_notifications_coalesced(self):
+        clock = task.Clock()
+        dataset = self._get_buffered_dataset(clock, notify_interval=1.0)
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+
+        dataset.listeners.add('first')
+        dataset.addData(data)
+        self.hub.onDataAvailable.assert_called_once_with(None, set(['first']))
+        self.hub.onRowCount.assert_called_once_with(1, set(['first']))
+
+        dataset.listeners.add('first')
+        dataset.addData(data)
+        dataset.listeners.add('second')
+        dataset.addData(data)
+        self.assertEqual(1, self.hub.onDataAvailable.call_count)
+        clock.advance(1.0)
+        self.assertEqual(2, self.hub.onDataAvailable.call_count)
+        self.hub.onDataAvailable.assert_called_with(None, set(['first', 'second']))
+        self.hub.onRowCount.assert_called_with(3, set(['first', 'second']))
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_threaded_io(self):
+        clock = ThreadedClock()
+        executor = backend.IOExecutor(threads=1, reactor=clock)
+        self.addCleanup(executor.stop)
+        dataset = Dataset(
+                self.session,
+                "Foo Name",
+                title=self._TITLE,
+                create=True,
+                independents=self._INDEPENDENTS,
+                dependents=self._DEPENDENTS,
+                executor=executor)
+        dataset.listeners.add('listener')
+        data = self._get_records_simple(
+                [(1, 2, 3), (4, 5, 6)], dataset.data.dtype)
+
+        written = []
+        dataset.addData(data).addCallback(written.append)
+        self.assertEqual([], written)
+        self.assertTrue(dataset.hasMore(0))
+        results = []
+        dataset.getData(None, 0, simpleOnly=True).addCallback(results.append)
+        clock.pump()
+        self.assertEqual([None], written)
+        self.hub.onDataAvailable.assert_called_with(None, set(['listener']))
+        self.assertEqual([], results)
+        clock.pump()
+        data_in_dataset, count = results[0]
+        self.assertEqual(2, count)
+        self.assertArrayEqual([[1, 2, 3], [4, 5, 6]], data_in_dataset)
+
 
 if __name__ == '__main__':
     pytest.main(['-v', '-s', __file__])
@@ -7,10 +7,11 @@ import unittest
 
 from twisted.internet import reactor, task
 
+from labrad import types as T
 from labrad.server import LabradServer, Signal, setting
 from labrad import server
 
-from datavault import backend, errors, server, SessionStore
+from datavault import backend, errors, server, util, SessionStore
 
 
 def _unique_dir():
@@ -174,6 +175,33 @@ class DataVaultTest(unittest.TestCase):
         # Check the dataset doesn't have anymore listeners.
         self.assertEqual(set([]), dataset.listeners)
 
+    def test_expire_context_after_changing_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        first = self.datavault.getDataset(self.context)
+        first.listeners.add(self.context.ID)
+        first.comment_listeners.add(self.context.ID)
+        self.datavault.cd(self.context, path='first', create=True)
+        self.datavault.new(
+                self.context, 'bar', [('x', 'ms')], [('y', 'E', 'eV')])
+        second = self.datavault.getDataset(self.context)
+        second.param_listeners.add(self.context.ID)
+        self.datavault.expireContext(self.context)
+        self.assertEqual(set(), first.listeners)
+        self.assertEqual(set(), first.comment_listeners)
+        self.assertEqual(set(), second.param_listeners)
+        self.assertEqual(set(), self.datavault.getSession(self.context).listeners)
+
+    def test_expire_context_drops_pending_notification(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(
+                self.context, 'foo', [('x', 'ms')], [('y', 'E', 'eV')])
+        dataset = self.datavault.getDataset(self.context)
+        dataset._notify_pending.add(self.context.ID)
+        self.datavault.expireContext(self.context)
+        self.assertEqual(set(), dataset._notify_pending)
+
     def test_get_dataset_not_yet_created(self):
         self.datavault.initContext(self.context)
         self.assertRaises(
@@ -345,5 +373,204 @@ class DataVaultTest(unittest.TestCase):
                 self.datavault.get,
                 self.context)
 
+    def test_new_extended_dataset_storage_options(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                64, 'lzf', True)
+        self.datavault.add_ex_t(self.context, [np.arange(100.), np.zeros(100)])
+        chunk_rows, compression, shuffle, stored, size, ratio = (
+                self.datavault.storage_info(self.context))
+        self.assertEqual(64, chunk_rows)
+        self.assertEqual('lzf', compression)
+        self.assertTrue(shuffle)
+        self.assertEqual(100 * 16, size)
+        self.assertAlmostEqual(float(size) / stored, ratio)
+
+    def test_storage_info_of_large_dataset(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x'], ['y'])
+        dataset = self.datavault.getDataset(self.context)
+        with mock.patch.object(dataset, 'storageInfo',
+                               return_value=(0, '', False, 5 * 10**9, 10**10)):
+            info = self.datavault.storage_info(self.context)
+        T.flatten(info, '(wsbvvv)')
+        self.assertEqual(5e9, info[3])
+        self.assertEqual(2.0, info[5])
+
+    def test_stream_rows(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')])
+        self.datavault.add_ex_t(self.context, [np.arange(3.), np.zeros(3)])
+        self.datavault.stream_rows(self.context, True, 2)
+        start, columns = self.hub.onNewRows.call_args[0][0]
+        self.assertEqual(0, start)
+        self.assertArrayEqual([0., 2.], columns[0])
+
+        self.datavault.add_ex_t(self.context, [np.arange(3., 6.), np.ones(3)])
+        (start, columns), contexts = self.hub.onNewRows.call_args[0]
+        self.assertEqual(4, start)
+        self.assertArrayEqual([4.], columns[0])
+        self.assertArrayEqual([1.], columns[1])
+        self.assertEqual([self.context.ID], contexts)
+
+        self.datavault.stream_rows(self.context, False)
+        self.assertEqual(6, self.context['filepos'])
+        self.datavault.add_ex_t(self.context, [np.arange(2.), np.ones(2)])
+        self.assertEqual(2, self.hub.onNewRows.call_count)
+        data = self.datavault.get_ex_t(self.context)
+        self.assertArrayEqual([0., 1.], data[0])
+
+    def test_get_envelope(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x'], ['y'])
+        self.datavault.add(self.context, np.column_stack(
+                [np.arange(10.), np.arange(10.)[::-1]]))
+        bucket_rows, mins, maxs, means = self.datavault.get_envelope(
+                self.context, 2)
+        self.assertEqual(5, bucket_rows)
+        self.assertArrayEqual([[0, 5], [5, 0]], mins)
+        self.assertArrayEqual([[4, 9], [9, 4]], maxs)
+        step, columns = self.datavault.get_decimated(self.context, 5, 1)
+        self.assertEqual(2, step)
+        self.assertArrayEqual([1, 3, 5, 7, 9], columns[0])
+        # plotting reads do not move the read position
+        self.assertEqual(10, len(self.datavault.get(self.context)))
+
+    def test_column_stats(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms'), ('label', [1], 's', '')],
+                [('n', 'E', [1], 'i', '')])
+        self.datavault.add_ex(self.context, [(0.5, 'a', 3), (1.5, 'b', -1)])
+        rows, mins, maxs, sums, _, lasts, counts = self.datavault.column_stats(self.context)
+        self.assertEqual(2, rows)
+        self.assertArrayEqual([0.5, -1], mins[[0, 2]])
+        self.assertArrayEqual([2, 2], sums[[0, 2]])
+        self.assertTrue(np.isnan(maxs[1]))
+        self.assertArrayEqual([1.5, -1], lasts[[0, 2]])
+        self.assertArrayEqual([2, 0, 2], counts)
+
+    def test_get_where(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x'], ['y'])
+        self.datavault.add(self.context, np.column_stack(
+                [np.arange(10.), np.arange(10.) * 2]))
+        rows, (x, y) = self.datavault.get_where(self.context, 1, 3, 7)
+        self.assertArrayEqual([2, 3], rows)
+        self.assertArrayEqual([2, 3], x)
+        self.assertArrayEqual([4, 6], y)
+        # searching does not move the read position
+        self.assertEqual(10, len(self.datavault.get(self.context)))
+
+    def test_get_time_range(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'log',
+                [('time', [1], 'v', 's')],
+                [('T', 'MC', [1], 'v', 'K')])
+        t = 1e9 + np.arange(20.) * 60
+        self.datavault.add(self.context, np.column_stack([t, t - 1e9]))
+        first, (temps,) = self.datavault.get_time_range(
+                self.context, t[-1] - 150, None, [1])
+        self.assertEqual(17, first)
+        self.assertArrayEqual([1020, 1080, 1140], temps)
+
+    def test_get_grid(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'scan', ['y', 'x'], ['z', 'w'])
+        y, x = [a.ravel() for a in np.mgrid[0:2, 0:3]]
+        rows = np.column_stack([y, x, x + 10 * y, -x])
+        self.datavault.add(self.context, rows[:4])
+        fast, _, _, images = self.datavault.get_grid(self.context)
+        self.assertEqual(1, fast)
+        self.assertEqual((2, 2, 3), images.shape)
+        self.datavault.add(self.context, rows[4:])
+        with mock.patch.object(backend.HDF5Data, 'getColumns', autospec=True,
+                               side_effect=backend.HDF5Data.getColumns) as get:
+            fast, x_values, y_values, images = self.datavault.get_grid(self.context)
+        self.assertEqual(4, get.call_args[0][2]) # only the new rows are read
+        self.assertArrayEqual([0, 1, 2], x_values)
+        self.assertArrayEqual([0, 1], y_values)
+        self.assertArrayEqual([[0, 1, 2], [10, 11, 12]], images[0])
+        self.assertArrayEqual([[0, -1, -2], [0, -1, -2]], images[1])
+
+    def test_get_grid_needs_two_independents(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x'], ['y'])
+        with self.assertRaises(errors.NotAGridError):
+            self.datavault.get_grid(self.context)
+
+    def test_get_grid_bad_fast_independent(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x', 'y'], ['z'])
+        self.datavault.add(self.context, [[0, 0, 1], [1, 0, 2]])
+        with self.assertRaises(errors.NoSuchColumnError):
+            self.datavault.get_grid(self.context, 2)
+
+    def test_add_and_get_raw(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms'), ('trace', [2], 'c', 'V')],
+                [('n', 'E', [1], 'i', '')])
+        x = np.arange(3.)
+        trace = np.arange(6.).reshape(3, 2) * 1j
+        n = np.array([4, 5, 6], dtype=np.int32)
+        self.datavault.add_raw(self.context, [util.to_raw(col) for col in (x, trace, n)])
+        raw = self.datavault.get_raw(self.context, [1, 2], 2)
+        self.assertEqual(['<c16', '<i4'], [r[0] for r in raw])
+        self.assertArrayEqual(trace[:2], util.from_raw(*raw[0]))
+        self.assertArrayEqual(n[:2], util.from_raw(*raw[1]))
+        (rest,) = self.datavault.get_raw(self.context, [0])
+        self.assertArrayEqual([2.], util.from_raw(*rest))
+        self.assertEqual(3, self.context['filepos'])
+
+    def test_get_raw_string_column_keeps_position(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new_ex(
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('name', 'E', [1], 's', '')])
+        self.datavault.add_ex(self.context, [(1.0, 'a'), (2.0, 'b')])
+        with self.assertRaises(errors.UnsupportedColumnError):
+            self.datavault.get_raw(self.context, [0, 1])
+        self.assertEqual(0, self.context['filepos'])
+        (x,) = self.datavault.get_raw(self.context, [0])
+        self.assertArrayEqual([1., 2.], util.from_raw(*x))
+
+    def test_new_extended_dataset_bad_compression(self):
+        self.datavault.initContext(self.context)
+        self.assertRaises(
+                errors.BadStorageOptionError,
+                self.datavault.new_ex,
+                self.context,
+                'foo',
+                [('x', [1], 'v', 'ms')],
+                [('y', 'E', [1], 'v', 'eV')],
+                0, 'bzip2')
+        self.assertEqual(([], []), self.datavault.dir(self.context))
+
+    def test_cache_stats(self):
+        self.datavault.initContext(self.context)
+        self.datavault.new(self.context, 'foo', ['x'], ['y'])
+        stats = dict(self.datavault.cache_stats(self.context))
+        self.assertGreaterEqual(stats['open files'], 1)
+        self.assertEqual(backend.MAX_OPEN_FILES, stats['max open files'])
+        self.assertIn('file hits', stats)
+        self.assertIn('file misses', stats)
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -1,8 +1,10 @@
+import gc
 import io
 import pytest
 import unittest
 
 import numpy as np
+from twisted.internet import task
 
 from datavault import util
 
@@ -51,10 +53,123 @@ class Testutil(unittest.TestCase):
         self.assertEqual(expected.dtype, actual.dtype, msg='dtype mismatch')
         self.assertTrue(np.array_equal(expected, actual), msg='array mismatch')
 
+    def test_from_record_array_is_view(self):
+        data = np.core.records.fromarrays([[1., 2.], [3., 4.]])
+        actual = util.from_record_array(data)
+        self.assertTrue(np.shares_memory(data, actual))
+        self.assertTrue(np.array_equal([[1, 3], [2, 4]], actual), msg='array mismatch')
+        mixed = np.core.records.fromarrays([[1, 2], [0.5, 1.5]], dtype='i4,f8')
+        actual = util.from_record_array(mixed)
+        self.assertTrue(np.array_equal([[1, 0.5], [2, 1.5]], actual), msg='array mismatch')
+
+    def test_rows_to_record_array_is_view(self):
+        data = np.arange(6.).reshape(3, 2)
+        rec = util.rows_to_record_array(data, 'f8,f8')
+        self.assertTrue(np.shares_memory(data, rec))
+        self.assertEqual([(0., 1.), (2., 3.), (4., 5.)], rec.tolist())
+
+    def test_rows_to_record_array_mixed(self):
+        rows = [(2**60 + 1, 0.5, 1j), (2, 1.5, 2j)]
+        rec = util.rows_to_record_array(rows, 'i8,f8,c16')
+        self.assertEqual(rows, rec.tolist())
+        data = np.array([[1, 2], [3, 4]])
+        rec = util.rows_to_record_array(data, 'i4,f8')
+        self.assertFalse(np.shares_memory(data, rec))
+        self.assertEqual([(1, 2.), (3, 4.)], rec.tolist())
+
+    def test_rows_to_record_array_not_scalar(self):
+        dtype = [('a', 'i8'), ('b', '2f8')]
+        rows = [(1, [0.5, 1.5]), (2, [2.5, 3.5])]
+        rec = util.rows_to_record_array(rows, dtype)
+        self.assertEqual([1, 2], rec['a'].tolist())
+        self.assertEqual([[0.5, 1.5], [2.5, 3.5]], rec['b'].tolist())
+
+    def test_raw_round_trip(self):
+        data = np.arange(6, dtype='>i4').reshape(3, 2)
+        dtype, shape, raw = util.to_raw(data)
+        self.assertEqual('<i4', dtype)
+        self.assertEqual([3, 2], shape)
+        self.assertEqual(24, len(raw))
+        actual = util.from_raw(dtype, shape, raw)
+        self.assertTrue(np.array_equal(data, actual), msg='array mismatch')
+
     def test_braced(self):
         actual = util.braced('foo')
         expected = '{' + 'foo' + '}'
         self.assertEqual(expected, actual)
 
+
+class _Cached(object):
+    pass
+
+
+class ObjectCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.lru = util.LRUCache(size=2, max_age=10, reactor=self.clock)
+        self.cache = util.ObjectCache(self.lru)
+
+    def test_keeps_recent_objects_alive(self):
+        self.cache['a'] = _Cached()
+        gc.collect()
+        self.assertIn('a', self.cache)
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(1, self.lru.hits)
+
+    def test_drops_least_recently_used(self):
+        self.cache['a'] = _Cached()
+        self.cache['b'] = _Cached()
+        self.cache.get('a')
+        self.cache['c'] = _Cached()
+        gc.collect()
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertIn('c', self.cache)
+        self.assertEqual(1, self.lru.evictions)
+
+    def test_referenced_objects_stay_after_eviction(self):
+        kept = _Cached()
+        self.cache['a'] = kept
+        self.cache['b'] = _Cached()
+        self.cache['c'] = _Cached()
+        gc.collect()
+        self.assertIs(kept, self.cache.get('a'))
+
+    def test_drops_unused_objects_after_max_age(self):
+        self.cache['a'] = _Cached()
+        self.clock.advance(5)
+        self.cache['b'] = _Cached()
+        self.clock.advance(5)
+        gc.collect()
+        self.assertNotIn('a', self.cache)
+        self.assertIn('b', self.cache)
+        self.clock.advance(5)
+        gc.collect()
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_new_cache_with_same_scope_finds_kept_objects(self):
+        self.cache = util.ObjectCache(self.lru, scope='x')
+        self.cache['a'] = _Cached()
+        gc.collect()
+        again = util.ObjectCache(self.lru, scope='x')
+        self.assertIn('a', again)
+        self.assertIsNotNone(again.get('a'))
+        self.assertIsNone(util.ObjectCache(self.lru, scope='y').get('a'))
+        self.assertEqual(1, self.lru.hits)
+        self.assertEqual(1, self.lru.misses)
+
+    def test_counts_misses(self):
+        self.assertIsNone(self.cache.get('a'))
+        stats = dict(self.lru.stats('thing'))
+        self.assertEqual(1, stats['thing misses'])
+        self.assertEqual(0, stats['thing cached'])
+
+    def test_size_zero_keeps_nothing(self):
+        cache = util.ObjectCache(util.LRUCache(size=0))
+        cache['a'] = _Cached()
+        gc.collect()
+        self.assertNotIn('a', cache)
+
 if __name__ == '__main__':
     pytest.main(['-v', __file__])
@@ -1,6 +1,9 @@
+import collections
 import configparser as cp
+import weakref
 
 import numpy as np
+from twisted.internet import defer, reactor
 
 
 class DVSafeConfigParser(cp.SafeConfigParser):
@@ -36,12 +39,189 @@ def to_record_array(data):
 def from_record_array(data):
     """Take a 1-D array of records and convert to a 2-D array.
 
-    The records must be homogeneous.
+    The records must be homogeneous.  When every field has the same type
+    and they are packed without padding the result is a view of data.
     """
-    return np.vstack([np.array(tuple(row)) for row in data])
+    data = np.asarray(data)
+    names = data.dtype.names
+    if names is None:
+        return np.atleast_2d(data)
+    fields = [data.dtype.fields[name] for name in names]
+    base = fields[0][0]
+    packed = all(f == base and offset == idx * base.itemsize
+                 for idx, (f, offset) in enumerate(fields))
+    if packed and not base.shape and data.dtype.itemsize == len(fields) * base.itemsize:
+        data = np.ascontiguousarray(data)
+        return data.view(base).reshape(len(data), len(fields))
+    return np.column_stack([data[name] for name in names])
+
+
+def rows_to_record_array(rows, dtype):
+    """Take rows of data and return a 1-D array of records of the given dtype.
+
+    When rows is a 2-D numeric array and every field is a numeric scalar
+    the array is converted by column rather than a tuple per row, and
+    when the fields also share one type and are packed without padding
+    the records are a view of the array.  Anything else, including lists
+    of clusters, goes through np.core.records.fromrecords, which is
+    already the fastest way to convert Python tuples.
+    """
+    dtype = np.dtype(dtype)
+    fields = [dtype.fields[name] for name in dtype.names]
+    if (isinstance(rows, np.ndarray) and rows.ndim == 2 and
+            rows.shape[1] == len(fields) and
+            all(f.shape == () and np.can_cast(rows.dtype, f, 'same_kind')
+                for f, _ in fields)):
+        base = fields[0][0]
+        packed = all(f == base and offset == idx * base.itemsize
+                     for idx, (f, offset) in enumerate(fields))
+        if packed and dtype.itemsize == len(fields) * base.itemsize:
+            rows = np.ascontiguousarray(rows, dtype=base)
+            return rows.view(dtype).reshape(-1).view(np.recarray)
+        return np.core.records.fromarrays(rows.T, dtype=dtype)
+    return np.core.records.fromrecords([tuple(row) for row in rows], dtype=dtype)
+
+
+def to_raw(column):
+    """Get a numeric column as (dtype, shape, bytes) for sending unflattened.
+
+    The bytes are little-endian, and dtype is the numpy type string, e.g.
+    '<f8'.  Use from_raw to get the array back.
+    """
+    column = np.asarray(column)
+    column = column.astype(column.dtype.newbyteorder('<'), copy=False)
+    column = np.ascontiguousarray(column)
+    return column.dtype.str, list(column.shape), column.tobytes()
+
+
+def from_raw(dtype, shape, data):
+    """Get an array from (dtype, shape, bytes) made by to_raw."""
+    return np.frombuffer(data, dtype=np.dtype(dtype)).reshape(shape)
 
 
 def braced(s):
     """Wrap the given string in braces, which is awkward with str.format"""
     return '{' + s + '}'
 
+
+def then(result, callback, *args, **kw):
+    """Call callback with result, or once result fires if it is a Deferred.
+
+    This lets the same code handle blocking calls that were made inline
+    and calls that were handed to a worker thread.  Returns the result of
+    callback, or a Deferred that fires with it.
+    """
+    if isinstance(result, defer.Deferred):
+        return result.addCallback(callback, *args, **kw)
+    return callback(result, *args, **kw)
+
+
+class LRUCache(object):
+    """Strong references to the most recently used objects.
+
+    Keeps up to size objects alive, dropping the least recently used one
+    when another is added, and drops objects that have not been used for
+    max_age seconds.  size=0 keeps nothing; max_age=0 means no age limit.
+    The hits and misses counters are kept by the ObjectCaches that use this.
+    """
+    def __init__(self, size=0, max_age=0, reactor=reactor):
+        self.size = size
+        self.max_age = max_age
+        self.reactor = reactor
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0 # objects dropped for size or age
+        self._entries = collections.OrderedDict() # key -> (value, used), oldest first
+        self._expireCall = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def touch(self, key, value):
+        """Add value to the cache, or mark it as just used."""
+        if not self.size:
+            return
+        self._entries[key] = (value, self.reactor.seconds())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        if self.max_age and self._expireCall is None:
+            self._expireCall = self.reactor.callLater(self.max_age, self._expire)
+
+    def get(self, key):
+        """Get the cached value for key, or None."""
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def _expire(self):
+        self._expireCall = None
+        cutoff = self.reactor.seconds() - self.max_age
+        while self._entries:
+            key, (value, used) = next(iter(self._entries.items()))
+            if used > cutoff:
+                self._expireCall = self.reactor.callLater(
+                        used - cutoff, self._expire)
+                break
+            del self._entries[key]
+            self.evictions += 1
+
+    def stats(self, name):
+        """Get a list of (name, value) counters for this cache."""
+        return [(name + ' cached', len(self._entries)),
+                (name + ' hits', self.hits),
+                (name + ' misses', self.misses),
+                (name + ' evictions', self.evictions)]
+
+
+class ObjectCache(object):
+    """Mapping of live objects, keeping recently used ones alive.
+
+    Objects stay in the mapping as long as something references them, like
+    a WeakValueDictionary, and also while they are in the LRUCache.  Several
+    ObjectCaches can share one LRUCache, using scope to tell their keys apart;
+    an ObjectCache made again with the same scope finds the objects that the
+    LRUCache kept alive.
+    """
+    def __init__(self, lru=None, scope=None):
+        self._objects = weakref.WeakValueDictionary()
+        self._lru = LRUCache() if lru is None else lru
+        self._scope = scope
+
+    def get(self, key, default=None):
+        """Get the object for key, counting a hit or a miss."""
+        value = self._objects.get(key)
+        if value is None:
+            value = self._lru.get((self._scope, key))
+            if value is None:
+                self._lru.misses += 1
+                return default
+            self._objects[key] = value
+        self._lru.hits += 1
+        self._lru.touch((self._scope, key), value)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._objects[key] = value
+        self._lru.touch((self._scope, key), value)
+
+    def __contains__(self, key):
+        return key in self._objects or (self._scope, key) in self._lru
+
+    def __len__(self):
+        return len(self._objects)
+
+    def values(self):
+        return list(self._objects.values())